@@ -12,16 +12,30 @@
 # https://www.deputy.com/api-doc/API
 
 import argparse
+import array
+import asyncio
 import collections
+import concurrent.futures
 import configparser
 import csv
 import datetime
+import email.utils
+import functools
+import hashlib
 import http.client
+import http.server
+import io
+import itertools
 import json
+import operator
 import os
+import random
 import re
 import socket
+import sqlite3
 import sys
+import threading
+import time
 import urllib.parse
 
 import gspread
@@ -31,67 +45,120 @@ from oauth2client.service_account import ServiceAccountCredentials
 def open_import_csv_reader(args):
     return  csv.DictReader(open(args.import_csv, encoding='utf-8-sig'))
 
-# Five classes as defined:
-#   Counter is a Dict subclass to simplify counters
+def import_csv_fingerprint(args):
+    # a hash of the import_csv file contents, e.g. to find its parsed rows in the ParseCache
+    with open(args.import_csv, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# Fourteen classes as defined:
+#   Counter to simplify counters, kept in an int array for each key
+#   Columns to hold resource records compactly as one array per field
 #   DeputyException for API errors
+#   ConnectionPool to reuse keep-alive HTTPS connections between API calls
+#   ResourceStore to keep a local copy of resources so only modified records are fetched
+#   ResponseCache to keep API responses for slowly changing resources between runs
+#   ParseCache to keep the parsed import_csv rows between runs
+#   MutationJournal to record changes so an interrupted run can be resumed
 #   Deputy to provide API access
+#   AsyncDeputy to provide the same API access as asyncio coroutines
 #   Printx to facilitate CSV output to stdout for some commands
 #   College, which extends Deputy and adds a number of college specific functions and methods.
+#   ReportServer and ReportHandler to serve College results over HTTP
 
 
 class Counter(object):
     """
     A class of counters with a total and a set for each key.
+
+    Each counter id has a fixed position, and the counts for a key are an array of ints in that 
+    order, so count() is two dict lookups and an array update. Counts are read as a dict of 
+    {id: count} for each key.
     """
+    __slots__ = ('ids', 'titles', 'position', 'initial', 'increment', 'data', 'total')
+
+    Counter = collections.namedtuple('Counter', ['id', 'title', 'count'])
+
     def __init__(self):
-        self.counters = collections.OrderedDict()
-        self.data     = collections.OrderedDict()
-        self.Desc     = collections.namedtuple('Desc', ['title', 'initial', 'increment'])
-        self.Counter  = collections.namedtuple('Counter', ['id', 'title', 'count'])
-        self.total    = collections.OrderedDict()
+        self.ids       = []
+        self.titles    = []
+        self.position  = {}
+        self.initial   = array.array('q')
+        self.increment = array.array('q')
+        self.data      = collections.OrderedDict()
+        self.total     = array.array('q')
 
     def add_counter(self, id, title=None, initial=0, increment=1):
-        self.counters[id] = self.Desc(title, initial, increment)
-        self.total[id] = initial
+        if id in self.position:
+            position = self.position[id]
+            self.titles[position]    = title
+            self.initial[position]   = initial
+            self.increment[position] = increment
+            self.total[position]     = initial
+            return
+        self.position[id] = len(self.ids)
+        self.ids.append(id)
+        self.titles.append(title)
+        self.initial.append(initial)
+        self.increment.append(increment)
+        self.total.append(initial)
+        # keys already counted get the new counter too
+        for counts in self.data.values():
+            counts.append(initial)
 
     def count(self, key='', id=None, increment=None):
-        if key not in self.data:
-            self.data[key] = {}
-            for c in self.counters:
-                self.data[key][c] = self.counters[c].initial
+        counts = self.data.get(key)
+        if counts is None:
+            counts = self.data[key] = array.array('q', self.initial)
+        position = self.position[id]
         if increment is None:
-            self.data[key][id] += self.counters[id].increment
-            self.total[id]     += self.counters[id].increment
-        else:
-            self.data[key][id] += increment
-            self.total[id]     += increment
+            increment = self.increment[position]
+        counts[position]    += increment
+        self.total[position] += increment
+
+    def count_many(self, keys, id=None, increment=None):
+        """
+        count() each key in keys (a key may be repeated) for the one counter id.
+        """
+        data     = self.data
+        initial  = self.initial
+        position = self.position[id]
+        if increment is None:
+            increment = self.increment[position]
+        n = 0
+        for key in keys:
+            counts = data.get(key)
+            if counts is None:
+                counts = data[key] = array.array('q', initial)
+            counts[position] += increment
+            n += 1
+        self.total[position] += increment * n
 
     def get_count(self, key, id=None):
         if id is None:
-            return self.data[key]
+            return dict(zip(self.ids, self.data[key]))
         else:
-            return self.data[key][id]
+            return self.data[key][self.position[id]]
 
     def get_total(self, id=None):
         if id is None:
-            return self.total
+            return collections.OrderedDict(zip(self.ids, self.total))
         else:
-            return self.total[id]
+            return self.total[self.position[id]]
 
     def get_totals(self):
         result = []
-        for id in self.counters:
-            result.append(self.Counter(id, self.counters[id].title, self.total[id]))
+        for position, id in enumerate(self.ids):
+            result.append(self.Counter(id, self.titles[position], self.total[position]))
         return result
 
     def __len__(self): 
         return len(self.data)
 
     def __repr__(self):
-        return repr(self.data)
+        return repr({key: self.get_count(key) for key in self.data})
 
     def __getitem__(self, key):
-        return self.data[key]
+        return self.get_count(key)
 
     def __iter__(self):
         return self.data.__iter__()
@@ -104,6 +171,101 @@ class Counter(object):
         del self.data[key]
 
 
+class Columns(object):
+    """
+    Resource records held as one array per field instead of one dict per record.
+
+    Integer and boolean fields are kept in typed arrays and strings are interned, so large Roster or 
+    Timesheet results use much less memory. A field changes to a plain list if a later record has a 
+    value of a different type (or None). Records are merged by 'key', as for Deputy.resource().
+
+    Rows are read like the OrderedDict from Deputy.resource(), i.e. columns[id] is a dict of the 
+    record, and column(field) returns the values of one field in row order.
+    """
+    TYPECODES = {bool: 'b', int: 'q'}
+
+    def __init__(self, records=(), key='Id', fields=None):
+        self.key     = key
+        self.fields  = None if fields is None else [key] + [field for field in fields if field != key]
+        self.index   = collections.OrderedDict()
+        self.columns = collections.OrderedDict()
+        self.types   = {}
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        """
+        Add a record, replacing any earlier record with the same key.
+        """
+        record_key = record[self.key]
+        row = self.index.get(record_key)
+        if row is None:
+            row = len(self.index)
+            self.index[record_key] = row
+        fields = self.fields if self.fields is not None else list(self.columns) + [f for f in record if f not in self.columns]
+        for field in fields:
+            self.set(field, row, record.get(field))
+
+    def set(self, field, row, value):
+        if isinstance(value, str):
+            value = sys.intern(value)
+        column = self.columns.get(field)
+        if column is None:
+            if row == 0 and type(value) in self.TYPECODES:
+                self.types[field] = type(value)
+                column = array.array(self.TYPECODES[type(value)])
+            else:
+                column = [None] * row
+            self.columns[field] = column
+        elif field in self.types and type(value) is not self.types[field]:
+            column = self.untype(field)
+        try:
+            if row == len(column):
+                column.append(value)
+            else:
+                column[row] = value
+        except OverflowError:
+            column = self.untype(field)
+            self.set(field, row, value)
+
+    def untype(self, field):
+        # a value does not fit the typed array, so keep the values in a list
+        field_type = self.types.pop(field)
+        column = [field_type(v) for v in self.columns[field]]
+        self.columns[field] = column
+        return column
+
+    def column(self, field):
+        """
+        Return the values of field in row order (booleans are 0 or 1 in a typed column).
+        """
+        return self.columns.get(field, [None] * len(self.index))
+
+    def row(self, row):
+        return {field: self.types.get(field, lambda v: v)(self.columns[field][row]) for field in self.columns}
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return (self.row(row) for row in self.index.values())
+
+    def items(self):
+        return ((record_key, self.row(row)) for record_key, row in self.index.items())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        return self.row(self.index[key])
+
+    def __iter__(self):
+        return self.index.__iter__()
+
+    def __contains__(self, item):
+        return item in self.index
+
+
 class DeputyException(Exception):
     def __init__(self, code, message):
         self.code = code
@@ -116,6 +278,404 @@ class DeputyException(Exception):
             return '[Exception: {0}] {1}'.format(self.code, self.message)
 
 
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTPS connections for each (host, port).
+
+    At most maxsize idle connections are kept for each host. Connections returned when the pool 
+    is full (or after close() is called) are closed rather than kept.
+    """
+    def __init__(self, timeout, maxsize=4):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.idle    = {}
+        self.lock    = threading.Lock()
+        self.closed  = False
+
+    def get(self, host, port):
+        """
+        Return a tuple (conn, reused) where reused is True if conn is an idle pooled connection.
+        A pooled connection may have been closed by the server since it was last used.
+        """
+        with self.lock:
+            idle = self.idle.get((host, port))
+            if idle:
+                return (idle.pop(), True)
+        return (http.client.HTTPSConnection(host, port, timeout=self.timeout), False)
+
+    def put(self, host, port, conn):
+        with self.lock:
+            idle = self.idle.setdefault((host, port), [])
+            if not self.closed and len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class ResourceStore(object):
+    """
+    A local SQLite copy of Deputy resources.
+
+    Records of a resource (for each combination of joined objects) are kept as members of each 
+    selection (the search terms) they were fetched with, along with the latest Modified timestamp 
+    seen for the resource. Later runs only fetch the records modified since that mark and merge them 
+    into every stored selection. A selection is fetched in full again once it is more than 
+    'reconcile' seconds old, which removes records deleted in Deputy (other than by this script) and 
+    picks up changes to joined objects, as neither changes the Modified timestamp.
+    """
+    def __init__(self, path, reconcile=86400):
+        self.path      = path
+        self.reconcile = reconcile
+        self.lock      = threading.Lock()
+        self.db        = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS record (name TEXT, id INTEGER, data TEXT, PRIMARY KEY (name, id));
+            CREATE TABLE IF NOT EXISTS member (name TEXT, terms TEXT, id INTEGER, PRIMARY KEY (name, terms, id));
+            CREATE TABLE IF NOT EXISTS selection (name TEXT, terms TEXT, reconciled REAL, PRIMARY KEY (name, terms));
+            CREATE TABLE IF NOT EXISTS mark (name TEXT PRIMARY KEY, modified TEXT);
+            """)
+
+    @staticmethod
+    def name(resource_name, join):
+        return '+'.join([resource_name] + sorted(join))
+
+    @staticmethod
+    def latest(records, mark=None):
+        # the latest Modified timestamp of the records (and mark), or None if there isn't one
+        latest = None if mark is None else datetime.datetime.fromisoformat(mark)
+        for record in records:
+            if record.get('Modified') is None:
+                continue
+            modified = datetime.datetime.fromisoformat(record['Modified'])
+            if latest is None or modified > latest:
+                latest, mark = modified, record['Modified']
+        return mark
+
+    def mark(self, name):
+        """
+        Return the high-water Modified timestamp for name, or None if it isn't known.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT modified FROM mark WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def due(self, name, terms):
+        """
+        Return True if the selection has never been fetched in full, or not for 'reconcile' seconds.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT reconciled FROM selection WHERE name = ? AND terms = ?', (name, terms)).fetchone()
+        return row is None or time.time() - row[0] >= self.reconcile
+
+    def replace(self, name, terms, records):
+        """
+        Store every record of a selection fetched in full, removing any member of the selection that 
+        was not fetched. Returns the number of records added, changed or removed (a record fetched 
+        again without any change is not counted).
+        """
+        records = list(records)
+        rows = [(name, record['Id'], json.dumps(record)) for record in records]
+        fetched = set(row[1] for row in rows)
+        with self.lock, self.db:
+            changes = self.db.total_changes
+            self.db.executemany("""
+                INSERT INTO record (name, id, data) VALUES (?, ?, ?)
+                ON CONFLICT (name, id) DO UPDATE SET data = excluded.data WHERE data != excluded.data
+                """, rows)
+            changes = self.db.total_changes - changes
+            members = set(row[0] for row in self.db.execute('SELECT id FROM member WHERE name = ? AND terms = ?', (name, terms)))
+            self.db.executemany('INSERT INTO member (name, terms, id) VALUES (?, ?, ?)', 
+                [(name, terms, id) for id in fetched - members])
+            removed = [(name, terms, id) for id in members - fetched]
+            self.db.executemany('DELETE FROM member WHERE name = ? AND terms = ? AND id = ?', removed)
+            changes += len(removed)
+            # records which are no longer in any selection
+            self.db.executemany("""
+                DELETE FROM record WHERE name = ? AND id = ? AND NOT EXISTS (SELECT 1 FROM member WHERE name = ? AND id = ?)
+                """, [(name, id, name, id) for _, _, id in removed])
+            self.db.execute('INSERT OR REPLACE INTO selection (name, terms, reconciled) VALUES (?, ?, ?)', 
+                (name, terms, time.time()))
+            # only the first fetch sets the mark, as other selections may not have been merged up to 
+            # the records of this one
+            self.db.execute('INSERT OR IGNORE INTO mark (name, modified) VALUES (?, ?)', (name, self.latest(records)))
+        return changes
+
+    def merge(self, name, records, match):
+        """
+        Merge records modified since the mark into every stored selection of name, using 
+        match(record, select) to work out the selections each record is now in, and move the mark 
+        forward. Returns the number of records added, changed or removed.
+        """
+        records = list(records)
+        with self.lock:
+            selections = [(terms, [tuple(term) for term in json.loads(terms)]) for (terms,) in 
+                self.db.execute('SELECT terms FROM selection WHERE name = ?', (name,))]
+        rows = []
+        members = []
+        removed = []
+        for record in records:
+            matched = set(terms for terms, select in selections if match(record, select))
+            if matched:
+                rows.append((name, record['Id'], json.dumps(record)))
+            for terms, _ in selections:
+                (members if terms in matched else removed).append((name, terms, record['Id']))
+        with self.lock, self.db:
+            changes = self.db.total_changes
+            self.db.executemany("""
+                INSERT INTO record (name, id, data) VALUES (?, ?, ?)
+                ON CONFLICT (name, id) DO UPDATE SET data = excluded.data WHERE data != excluded.data
+                """, rows)
+            changes = self.db.total_changes - changes
+            self.db.executemany('INSERT OR IGNORE INTO member (name, terms, id) VALUES (?, ?, ?)', members)
+            self.db.executemany('DELETE FROM member WHERE name = ? AND terms = ? AND id = ?', removed)
+            # a record joins or leaves a selection only when its data changes, which is counted above, 
+            # so only the records no longer in any selection are added to the changes
+            deleted = self.db.total_changes
+            self.db.executemany("""
+                DELETE FROM record WHERE name = ? AND id = ? AND NOT EXISTS (SELECT 1 FROM member WHERE name = ? AND id = ?)
+                """, [(name, id, name, id) for _, _, id in removed])
+            changes += self.db.total_changes - deleted
+            row = self.db.execute('SELECT modified FROM mark WHERE name = ?', (name,)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE mark SET modified = ? WHERE name = ?', (self.latest(records, row[0]), name))
+        return changes
+
+    def records(self, name, terms):
+        """
+        Yield the stored records of a selection in Id order.
+        """
+        with self.lock:
+            cursor = self.db.execute("""
+                SELECT record.data FROM member JOIN record ON record.name = member.name AND record.id = member.id 
+                WHERE member.name = ? AND member.terms = ? ORDER BY member.id
+                """, (name, terms))
+            rows = cursor.fetchmany(500)
+        while rows:
+            for row in rows:
+                yield json.loads(row[0])
+            with self.lock:
+                rows = cursor.fetchmany(500)
+
+    def delete(self, resource_name, id):
+        # remove the record from every stored join of the resource
+        with self.lock, self.db:
+            for table in ('record', 'member'):
+                self.db.execute("DELETE FROM {0} WHERE (name = ? OR name LIKE ?) AND id = ?".format(table), 
+                    (resource_name, resource_name + '+%', id))
+
+    def clear(self):
+        with self.lock, self.db:
+            for table in ('record', 'member', 'selection', 'mark'):
+                self.db.execute('DELETE FROM {0}'.format(table))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ResponseCache(object):
+    """
+    A local SQLite cache of GET and QUERY API responses.
+
+    Responses are kept for the number of seconds in ttls for the resource (e.g. {'trainingmodule': 86400}), 
+    or default_ttl for any other API. A ttl of zero means the API is not cached. The least recently 
+    used responses are removed when there are more than max_entries.
+    """
+    def __init__(self, path, ttls={}, default_ttl=0, max_entries=1000):
+        self.path        = path
+        self.ttls        = {name.lower(): ttl for name, ttl in ttls.items()}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.lock        = threading.Lock()
+        self.db          = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, name TEXT, data TEXT, expires REAL, used REAL)
+            """)
+
+    @staticmethod
+    def name(api):
+        """
+        Return the resource name for an API, e.g. 'trainingmodule' for resource/TrainingModule/QUERY, 
+        otherwise the API itself (e.g. 'me').
+        """
+        api_parts = api.split('/')
+        if len(api_parts) > 1 and api_parts[0] == 'resource':
+            return api_parts[1].lower()
+        return api.lower()
+
+    @staticmethod
+    def key(endpoint, token, api, method, body):
+        # responses differ between Deputy installs and users, so the endpoint and a hash of the token 
+        # (never the token itself) are part of the key
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        return hashlib.sha256('{0} {1} {2} {3} {4}'.format(endpoint, token_hash, method, api, body).encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, token, api, method, body):
+        """
+        Return the cached response text, or None if it is not cached or has expired.
+        """
+        key = self.key(endpoint, token, api, method, body)
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute('SELECT data FROM response WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE response SET used = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, endpoint, token, api, method, body, data):
+        name = self.name(api)
+        ttl = self.ttls.get(name, self.default_ttl)
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO response (key, name, data, expires, used) VALUES (?, ?, ?, ?, ?)', 
+                (self.key(endpoint, token, api, method, body), name, data, now + ttl, now))
+            self.db.execute("""
+                DELETE FROM response WHERE key NOT IN (SELECT key FROM response ORDER BY used DESC LIMIT ?)
+                """, (self.max_entries,))
+
+    def invalidate(self, api):
+        # remove all cached responses for the resource changed by api
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM response WHERE name = ?', (self.name(api),))
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM response')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ParseCache(object):
+    """
+    A local SQLite cache of parsed import_csv rows.
+
+    The parsed rows are kept under a fingerprint of the import_csv file (see import_csv_fingerprint()) 
+    and the configuration used to parse them, so an unchanged file is not even read again. The least recently used entries are 
+    removed when there are more than max_entries.
+    """
+    def __init__(self, path, max_entries=8):
+        self.path        = path
+        self.max_entries = max_entries
+        self.lock        = threading.Lock()
+        self.db          = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS parsed (key TEXT PRIMARY KEY, data TEXT, used REAL)
+            """)
+
+    @staticmethod
+    def key(fingerprint, *config):
+        # any change to the file or to the configuration gives a different key
+        return hashlib.sha256(json.dumps([fingerprint, config]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return the list of (messages, row) tuples for key, or None if it is not cached.
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT data FROM parsed WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE parsed SET used = ? WHERE key = ?', (time.time(), key))
+        return [tuple(parsed) for parsed in json.loads(row[0])]
+
+    def put(self, key, parsed):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO parsed (key, data, used) VALUES (?, ?, ?)', 
+                (key, json.dumps(parsed), time.time()))
+            self.db.execute("""
+                DELETE FROM parsed WHERE key NOT IN (SELECT key FROM parsed ORDER BY used DESC LIMIT ?)
+                """, (self.max_entries,))
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM parsed')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class MutationJournal(object):
+    """
+    A write-ahead journal of the changes made by Deputy.bulk(), as one JSON object per line.
+
+    Each change is recorded as planned before it is made, then as done (or failed), so a run that 
+    stops part way can be repeated without making the completed changes again. Every entry carries 
+    the 'run' fingerprint (see fingerprint()), and only changes done by a run with the same 
+    fingerprint are skipped, so a journal left by a different input or Deputy is ignored. Writes are 
+    locked, so the journal can be shared by bulk() worker threads.
+    """
+    def __init__(self, path, run):
+        self.path = path
+        self.run  = run
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete if the run stopped while writing it
+                        continue
+                    if entry['state'] == 'done' and entry.get('run') == run:
+                        self.done.add(entry['id'])
+        # start again if nothing in the journal belongs to this run
+        self.file = open(path, 'a' if self.done else 'w')
+
+    @staticmethod
+    def command_path(path, command):
+        # one journal per command, e.g. deputy-journal.jsonl -> deputy-journal-delete-users.jsonl
+        (root, ext) = os.path.splitext(path)
+        return '{0}-{1}{2}'.format(root, command, ext)
+
+    @staticmethod
+    def fingerprint(*parts):
+        # identifies a run by what it was asked to do, such as the command, endpoint and input file
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    @staticmethod
+    def id(mutation):
+        return hashlib.sha256(json.dumps([mutation.method, mutation.api, mutation.data], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_done(self, mutation):
+        return self.id(mutation) in self.done
+
+    def record(self, mutation, state):
+        entry = {'id': self.id(mutation), 'run': self.run, 'state': state, 'key': mutation.key, 
+            'method': mutation.method, 'api': mutation.api}
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if state == 'done':
+                self.done.add(entry['id'])
+
+    def close(self, remove=False):
+        # remove the journal once everything is done, so the changes can be made again in a later run
+        with self.lock:
+            self.file.close()
+            if remove:
+                os.remove(self.path)
+
+
 class Deputy(object):
     """
     This class and its subclasses are the only place the Deputy API is invoked.
@@ -127,11 +687,75 @@ class Deputy(object):
     DEPUTY_COLS = ('First Name', 'Last Name', 'Time Card Number', 'Email', 'Mobile Number', 
         'Birth Date', 'Employment Date', 'Weekday', 'Saturday', 'Sunday', 'Public Holiday')
 
-    def __init__(self, endpoint, token, timeout):
+    # QUERY search types that can also be evaluated on records held in a ResourceStore.
+    SEARCH_TYPES = {
+        'eq': operator.eq,
+        'ne': operator.ne,
+        'gt': operator.gt,
+        'ge': operator.ge,
+        'lt': operator.lt,
+        'le': operator.le,
+        'in': lambda value, data: value in data,
+        }
+    ORDERING_TYPES = ('gt', 'ge', 'lt', 'le')
+
+    # A change made by bulk() and its result.
+    Mutation       = collections.namedtuple('Mutation', ['key', 'api', 'method', 'data'])
+    MutationResult = collections.namedtuple('MutationResult', ['key', 'api', 'method', 'ok', 'response'])
+
+    # HTTP status codes for which a request is retried.
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    MAX_BACKOFF  = 60
+    # records in each QUERY page, hardcoded in deputy's API
+    PAGE_SIZE    = 500
+
+    def __init__(self, endpoint, token, timeout, pool_size=4, workers=1, store=None, cache=None, 
+            retries=0, backoff=1.0, budget=None, write_workers=1, max_wait=600):
         self.endpoint = endpoint
         self.token    = token
         self.timeout  = timeout
         self.progress = Deputy.sample_progress
+        self.pool     = ConnectionPool(timeout, maxsize=max(pool_size, workers, write_workers))
+        self.workers  = workers
+        self.write_workers = write_workers
+        self.executor = None
+        self.lock     = threading.Lock()
+        self.store    = store
+        # store selections read by this process, which poll() checks, and those fetched by the last poll()
+        self.selected = set()
+        self.polled   = set()
+        self.cache    = cache
+        self.retries  = retries
+        self.backoff  = backoff
+        self.budget   = budget
+        # the longest Retry-After (or X-RateLimit-Reset) the server may ask for before giving up
+        self.max_wait = max_wait
+        self.rate_limit_until = 0
+
+
+    def close(self):
+        """
+        Close any pooled HTTPS connections, stop the page fetching threads and close the store and cache.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pool.close()
+        if self.store is not None:
+            self.store.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+    def page_executor(self):
+        """
+        Return the thread pool shared by all resource() calls, so no more than self.workers pages 
+        are fetched at once.
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            return self.executor
 
 
     @staticmethod
@@ -158,10 +782,6 @@ class Deputy(object):
         #print('API', api)
 
         url = urllib.parse.urlparse(urllib.parse.urljoin(self.endpoint, api))
-        try:
-            conn = http.client.HTTPSConnection(url.hostname, url.port, timeout=self.timeout)
-        except:
-            raise DeputyException('invalid_url' 'Invalid URL: {0}'.format(self.endpoint))
 
         # format POST or PUT data as JSON and create the appripriate headers
         body = json.dumps(data)
@@ -172,35 +792,225 @@ class Deputy(object):
             }
         if dp_meta is False:
             headers['dp-meta-option'] = 'none'
-        try:
-            conn.request(method, url.path, body, headers)
-            resp = conn.getresponse()
-        except KeyboardInterrupt:
-            raise DeputyException('user_exit', 'Ctrl-C - User requested exit.')
-        except socket.timeout:
-            raise DeputyException('socket_timeout', 'Socket timeout for API {0}'.format(api))
-        except socket.error as e:
-            # This exception is raised for socket-related errors.
-            raise DeputyException('sockey_error', 'Socket error ({0}) for API {1}.'.format(e.errno, api))
-        #print(resp.status, resp.reason, dict(resp.getheaders()), resp.read())
+
+        # only GET and QUERY responses are cached, any other call may change the resource
+        cacheable = method == 'GET' or api.endswith('/QUERY')
+        if self.cache is not None and cacheable:
+            cached = self.cache.get(self.endpoint, self.token, api, method, body)
+            if cached is not None:
+                return json.loads(cached)
+
+        # only calls which don't change anything are retried (Deputy reports an error if a record is deleted twice)
+        retryable = cacheable
+        attempt = 0
+        while True:
+            try:
+                resp, resp_data = self.request(url, method, body, headers, api)
+            except DeputyException as e:
+                if retryable and e.code in ('socket_timeout', 'sockey_error') and attempt < self.retries:
+                    self.retry_wait(None, attempt, api)
+                    attempt += 1
+                    continue
+                raise
+            if retryable and resp.status in self.RETRY_STATUS and attempt < self.retries:
+                self.retry_wait(resp, attempt, api)
+                attempt += 1
+                continue
+            break
+
+        #print(resp.status, resp.reason, dict(resp.getheaders()), resp_data)
         if resp.status == 302:
             raise DeputyException('unexpected_api', 'Unexpected API {0} response {1} {2} using API URL {3}.'.format(api, resp.status, resp.reason, url.geturl()))
         if resp.status != 200:
             raise DeputyException('http_error', 'API {0} failed with {1} {2}.'.format(api, resp.status, resp.reason))
 
+        # keep the local store in step with records deleted by this script, e.g. resource/TrainingRecord/123
+        if method == 'DELETE' and self.store is not None:
+            api_parts = api.split('/')
+            if len(api_parts) == 3 and api_parts[0] == 'resource':
+                self.store.delete(api_parts[1], int(api_parts[2]))
+
         try:
-            resp = resp.read().decode('utf-8')
+            resp = resp_data.decode('utf-8')
             api_resp = json.loads(resp)
         except ValueError:
-            if len(resp) == 0:
+            if len(resp_data) == 0:
                 raise DeputyException('json_response_empty', 'Error parsing JSON API Response for {0} (zero length)'.format(api))
             else:
                 raise DeputyException('json_response_parse', 'Error parsing JSON API Response for {0}'.format(api))
-        conn.close()
+        if self.cache is not None:
+            if cacheable:
+                self.cache.put(self.endpoint, self.token, api, method, body, resp)
+            else:
+                self.cache.invalidate(api)
         return api_resp
 
 
-    def resource(self, resource_name, key='Id', sort='Id', join=[], select=None):
+    def request(self, url, method, body, headers, api):
+        """
+        Make one HTTP request using a pooled connection. Returns (resp, resp_data).
+        Counts against the request budget and waits if the rate limit has been reached.
+
+        May raise DeputyException.
+        """
+        with self.lock:
+            if self.budget is not None:
+                if self.budget <= 0:
+                    raise DeputyException('request_budget', 'Request budget used up before API {0}.'.format(api))
+                self.budget -= 1
+            wait = self.rate_limit_until - time.time()
+        if wait > 0:
+            self.sleep(wait)
+
+        # a request that may have reached the server is only sent again if repeating it is harmless
+        idempotent = method == 'GET' or api.endswith('/QUERY')
+        while True:
+            try:
+                conn, reused = self.pool.get(url.hostname, url.port)
+            except:
+                raise DeputyException('invalid_url', 'Invalid URL: {0}'.format(self.endpoint))
+            sent = False
+            try:
+                conn.request(method, url.path, body, headers)
+                sent = True
+                resp = conn.getresponse()
+                # the whole response must be read before the connection can be reused
+                resp_data = resp.read()
+            except KeyboardInterrupt:
+                conn.close()
+                raise DeputyException('user_exit', 'Ctrl-C - User requested exit.')
+            except socket.timeout:
+                conn.close()
+                raise DeputyException('socket_timeout', 'Socket timeout for API {0}'.format(api))
+            except (socket.error, http.client.HTTPException) as e:
+                conn.close()
+                if reused and (not sent or idempotent):
+                    # the server has closed an idle keep-alive connection, so try again with another one
+                    continue
+                # This exception is raised for socket-related errors.
+                raise DeputyException('sockey_error', 'Socket error ({0}) for API {1}.'.format(getattr(e, 'errno', None), api))
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(url.hostname, url.port, conn)
+
+        # when no requests remain in the rate limit window, hold further requests until it resets
+        if resp.getheader('X-RateLimit-Remaining') == '0':
+            reset = self.header_seconds(resp.getheader('X-RateLimit-Reset'))
+            if reset is not None:
+                with self.lock:
+                    self.rate_limit_until = max(self.rate_limit_until, time.time() + reset)
+        return (resp, resp_data)
+
+
+    def retry_wait(self, resp, attempt, api):
+        """
+        Wait before retrying a failed request. Uses the Retry-After (or X-RateLimit-Reset) header if the 
+        response has one, otherwise a random delay up to backoff * 2 ** attempt seconds (at most 
+        MAX_BACKOFF).
+
+        May raise DeputyException if the server asks for a wait longer than max_wait seconds.
+        """
+        delay = None
+        if resp is not None:
+            delay = self.header_seconds(resp.getheader('Retry-After'))
+            if delay is None:
+                delay = self.header_seconds(resp.getheader('X-RateLimit-Reset'))
+        if delay is None:
+            delay = random.uniform(0, min(self.MAX_BACKOFF, self.backoff * 2 ** attempt))
+        elif delay > self.max_wait:
+            # don't retry sooner than the server asks, but don't sit idle for longer than max_wait either
+            raise DeputyException('retry_after', 'API {0} failed with {1} {2}, retry after {3:.0f} seconds.'.format(
+                api, resp.status, resp.reason, delay))
+        self.progress('retry', api, attempt + 1)
+        self.sleep(delay)
+
+
+    @staticmethod
+    def header_seconds(value):
+        """
+        Return the number of seconds to wait from a Retry-After or X-RateLimit-Reset header, which may be
+        a number of seconds, a Unix time or an HTTP date. Returns None if there is no usable value.
+        """
+        if value is None:
+            return None
+        try:
+            seconds = float(value)
+            if seconds > 1000000000:
+                # a Unix time rather than a number of seconds
+                seconds -= time.time()
+        except ValueError:
+            try:
+                seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return max(seconds, 0)
+
+
+    @staticmethod
+    def sleep(seconds):
+        try:
+            time.sleep(seconds)
+        except KeyboardInterrupt:
+            raise DeputyException('user_exit', 'Ctrl-C - User requested exit.')
+
+
+    def bulk(self, mutations, workers=None, journal=None):
+        """
+        Make many changes at once. 'mutations' is a list of lists of Mutation(key, api, method, data), 
+        where key identifies the change in messages, such as an employee name.
+
+        The calls in each inner list are made in order, stopping at the first failure, so for example 
+        an old record can be deleted before its replacement is added. The lists are processed at the 
+        same time using up to 'workers' threads (default self.write_workers).
+
+        Returns a list of MutationResult(key, api, method, ok, response) in the order of 'mutations', where 
+        response is the API response, or the DeputyException if ok is False. Calls after a failure 
+        are not made and have no result.
+
+        If a MutationJournal is given, each call is recorded in it before and after it is made, and 
+        calls recorded as done by an earlier run are skipped (with a response of None). The journal 
+        is closed afterwards, and removed if every call succeeded.
+        """
+        if workers is None:
+            workers = self.write_workers
+
+        def run(group):
+            results = []
+            for mutation in group:
+                if journal is not None:
+                    if journal.is_done(mutation):
+                        results.append(self.MutationResult(mutation.key, mutation.api, mutation.method, True, None))
+                        continue
+                    journal.record(mutation, 'planned')
+                try:
+                    api_resp = self.api(mutation.api, method=mutation.method, data=mutation.data)
+                except DeputyException as e:
+                    if e.code == 'user_exit':
+                        raise
+                    if journal is not None:
+                        journal.record(mutation, 'failed')
+                    results.append(self.MutationResult(mutation.key, mutation.api, mutation.method, False, e))
+                    break
+                if journal is not None:
+                    journal.record(mutation, 'done')
+                results.append(self.MutationResult(mutation.key, mutation.api, mutation.method, True, api_resp))
+            return results
+
+        results = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                for group_results in executor.map(run, mutations):
+                    results.extend(group_results)
+        finally:
+            if journal is not None:
+                journal.close(remove=len(results) == sum(len(group) for group in mutations) and all(r.ok for r in results))
+        return results
+
+
+    def resource(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False, fields=None, normalise=False):
         """
         Get all resources where there might be more than 500 resources.
         Resource name is just 'Employee' or 'Contact' -- just the name of the resource.
@@ -209,6 +1019,19 @@ class Deputy(object):
         'sort' is they data key to sort by.
         'join' is a list of objects to include in the record, such as ['ContactObject']
         'select' is one or more additional search terms select=[(field, type, data)]
+        'workers' is the number of pages requested at once (default self.workers). The first page 
+            is requested alone, and only if it is full are the next pages requested 'workers' at a 
+            time. Pages beyond the last one are requested speculatively and ignored once a short page 
+            is seen.
+        'keyset' pages by Id (sort must be 'Id') by selecting records with an Id greater than the last 
+            one seen, instead of using an offset. Each page costs the same and records are not skipped 
+            or repeated if the resource changes during the fetch. Pages are fetched one at a time.
+        'fields' is a list of the fields to keep in each record, e.g. ['Employee', 'Open']. The 'key' 
+            field is always kept. QUERY always returns every field, so records are trimmed as each 
+            page arrives, which keeps only the needed fields in memory.
+        'normalise' replaces each joined object with one shared copy for each Id, so thousands of 
+            rosters joining the same OperationalUnitObject refer to a single dict. The shared objects 
+            must not be changed.
         The result an OrderedDict of namedtuple with the key as specified in the call order by 'sort'.
 
         QUERY is very powerful by only the simplest features are used here.
@@ -216,32 +1039,256 @@ class Deputy(object):
 
         May raise DeputyException from the API call.
         """
-        window = 500    # hardcoded in deputy's API.
-        position = 0
         result = collections.OrderedDict()
+        for record in self.iter_resource(resource_name, key=key, sort=sort, join=join, select=select, 
+                workers=workers, keyset=keyset, fields=fields, normalise=normalise):
+            result[record[key]] = record
+        self.progress('resource', resource_name, len(result))
+        return result
+
+
+    def iter_resource(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False, fields=None, normalise=False):
+        """
+        A generator version of resource() which yields each record as its page arrives, in 'sort' order, 
+        so the whole resource is never held in memory. The arguments are the same as resource().
+
+        Unlike resource(), records are not merged by 'key', so a record may be yielded twice if the 
+        resource changes during the fetch.
+
+        If there is a local store, only records modified since the last fetch are requested and merged 
+        into it (see ResourceStore for how deleted records are found), and the result is read from 
+        the store. The store keeps every field.
+
+        May raise DeputyException from the API call.
+        """
+        if self.store is not None and all(s_type in self.SEARCH_TYPES for _, s_type, _ in select or []):
+            records = self.stored_resource(resource_name, sort=sort, join=join, select=select)
+        else:
+            records = self.fetch_resource(resource_name, key=key, sort=sort, join=join, select=select, 
+                workers=workers, keyset=keyset)
+        yield from self.shape(records, key=key, join=join, fields=fields, normalise=normalise)
+
+
+    @classmethod
+    def shape(cls, records, key='Id', join=[], fields=None, normalise=False, table=None):
+        """
+        Yield records with the 'fields' and 'normalise' options of resource() applied. 'table' is 
+        passed to normalise().
+        """
+        if normalise:
+            records = cls.normalise(records, join, table)
+        if fields is None:
+            yield from records
+        else:
+            fields = [key] + [field for field in fields if field != key]
+            for record in records:
+                yield cls.project(record, fields)
+
+
+    @staticmethod
+    def normalise(records, join, table=None):
+        """
+        Yield records with each joined object (e.g. OperationalUnitObject) replaced by the first one 
+        seen with the same Id, so records joining the same object share it.
+
+        'table' is the {(join, Id): object} dict of shared objects, which may be passed to share 
+        objects between calls.
+        """
+        if table is None:
+            table = {}
+        for record in records:
+            for name in join:
+                joined = record.get(name)
+                if isinstance(joined, dict) and 'Id' in joined:
+                    record[name] = table.setdefault((name, joined['Id']), joined)
+            yield record
+
+
+    @staticmethod
+    def project(record, fields):
+        """
+        Return a copy of record with only the listed fields (those not in the record are left out).
+        """
+        return {field: record[field] for field in fields if field in record}
+
+
+    def stored_resource(self, resource_name, sort='Id', join=[], select=None):
+        """
+        Bring the records matching 'select' in the local store up to date, then yield them ordered 
+        by 'sort'.
+
+        May raise DeputyException from the API call.
+        """
+        name = self.store.name(resource_name, join)
+        self.update_store(name, select)
+        records = self.store.records(name, json.dumps(select or []))
+        if sort == 'Id':
+            yield from records
+        else:
+            yield from sorted(records, key=lambda record: (record[sort] is None, record[sort]))
+
+
+    def update_store(self, name, select, modified=True):
+        """
+        Bring the selection 'select' of store name (e.g. 'Roster+OperationalUnitObject') up to date. 
+        Returns the number of records added, changed or removed.
+
+        If 'modified' is set, the records of the resource modified since the store's mark are 
+        fetched and merged. Then, if the selection has never been fetched in full or is due to be 
+        reconciled (see ResourceStore), the whole selection is fetched.
+
+        A selection already fetched by the last poll() is read from the store until the next poll(), 
+        so `watch` and `serve` work out their results from what poll() found without fetching it twice.
+
+        May raise DeputyException from the API call.
+        """
+        terms = json.dumps(select or [])
+        with self.lock:
+            self.selected.add((name, terms))
+            if (name, terms) in self.polled:
+                return 0
+        resource_name, *join = name.split('+')
+        changes = 0
+        mark = self.store.mark(name)
+        if modified and mark is not None:
+            # every record modified since the mark, not just those in 'select', so records which 
+            # have left a selection are seen
+            records = self.fetch_resource(resource_name, join=join, select=[('Modified', 'ge', mark)])
+            changes += self.store.merge(name, records, self.select_match)
+        if mark is None or self.store.due(name, terms):
+            # without a mark (no Modified field) the selection is fetched in full every time
+            records = self.fetch_resource(resource_name, join=join, select=select)
+            changes += self.store.replace(name, terms, records)
+        return changes
+
+
+    def poll(self):
+        """
+        Bring every store selection read by this process up to date, fetching the modified records of 
+        each resource once. Selections left in the store by other runs are not checked. Returns the 
+        number of records added, changed or removed, so zero means nothing has changed.
+
+        May raise DeputyException from the API call.
+        """
+        with self.lock:
+            self.polled = set()
+            selections = sorted(self.selected)
+        changes = 0
+        merged = set()
+        for name, terms in selections:
+            select = [tuple(term) for term in json.loads(terms)]
+            changes += self.update_store(name, select, modified=name not in merged)
+            merged.add(name)
+        polled = set(selections)
+        with self.lock:
+            self.polled = polled
+        return changes
+
+
+    @classmethod
+    def select_match(cls, record, select):
+        """
+        Return True if the record matches all the 'select' search terms.
+
+        For the ordering types (gt, ge, lt, le) strings are compared on the length of the search data, 
+        so a Date of '2019-12-31T09:00:00+11:00' is 'le' '2019-12-31', as it is for QUERY. eq, ne and in 
+        are exact. A term with no data (e.g. no start_date) is ignored, and a record with no value for 
+        an ordering term does not match.
+        """
+        for s_field, s_type, s_data in select or []:
+            if s_data is None:
+                continue
+            value = record.get(s_field)
+            if s_type in cls.ORDERING_TYPES:
+                if value is None:
+                    return False
+                if isinstance(value, str) and isinstance(s_data, str):
+                    value = value[:len(s_data)]
+            if not cls.SEARCH_TYPES[s_type](value, s_data):
+                return False
+        return True
+
+
+    def fetch_resource(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False):
+        """
+        Yield records fetched from the Deputy QUERY API. See iter_resource().
+
+        May raise DeputyException from the API call.
+        """
+        api = 'resource/{0}/QUERY'.format(resource_name)
+
+        def fetch(query):
+            return self.api(api, method='POST', data=query)
+
+        plan = self.page_queries(resource_name, key=key, sort=sort, join=join, select=select, 
+            workers=workers, keyset=keyset)
+        queries = next(plan)
+        while True:
+            if len(queries) > 1:
+                pages = self.page_executor().map(fetch, queries)
+            else:
+                pages = map(fetch, queries)
+            # pages are yielded in position order, so records remain in 'sort' order
+            fetched = []
+            for api_resp in pages:
+                yield from api_resp
+                if len(api_resp) < self.PAGE_SIZE:
+                    return
+                fetched.append(api_resp)
+            queries = plan.send(fetched)
+
+
+    def page_queries(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False):
+        """
+        Plan the QUERY requests of a resource() call, for fetch_resource() and AsyncDeputy.resource() 
+        to make. A generator which yields a list of queries to request at once, then is sent the full 
+        pages returned for them (in order) and yields the next queries. The caller stops at the first 
+        short page.
+
+        The first page is requested alone, so a resource that fits in one page costs one request. 
+        After that, offset pages are requested 'workers' at a time and keyset pages one at a time.
+
+        May raise DeputyException for an invalid query.
+        """
+        if workers is None:
+            workers = self.workers
+        if keyset and sort != 'Id':
+            raise DeputyException('invalid_query', 'Keyset paging of {0} requires sort=Id.'.format(resource_name))
+
+        position = 0
+        cursor = []
+        batch = 1
         while True:
             self.progress('resource', resource_name, position)
-            query = {
-                'search': {
-                    'f1':{'field':key, 'type':'is', 'data':''}
-                        }, 
-                'sort': {sort: 'asc'},
-                'join' : join,
-                'start': position
-                }
-            if select is not None:
-                for s_field, s_type, s_data in select:
-                    query['search'][s_field+'_'+str(s_data)] = {'field':s_field, 'type':s_type, 'data':s_data}
-            api_resp = self.api('resource/{0}/QUERY'.format(resource_name), method='POST', data=query)
-            for record in api_resp:
-                result[record[key]] = record
-            #print(len(api_resp), resource_name, position)
-            if len(api_resp) == window:
-                position += window
+            if keyset:
+                queries = [self.resource_query(key, sort, join, list(select or []) + cursor, 0)]
             else:
-                break
-        self.progress('resource', resource_name, len(result))
-        return result
+                queries = [self.resource_query(key, sort, join, select, position + self.PAGE_SIZE * i) for i in range(batch)]
+            pages = yield queries
+            position += self.PAGE_SIZE * len(pages)
+            if keyset:
+                cursor = [('Id', 'gt', pages[-1][-1]['Id'])]
+            else:
+                batch = max(workers, 1)
+
+
+    @staticmethod
+    def resource_query(key, sort, join, select, position):
+        """
+        Return the QUERY request data for one page of a resource() call.
+        """
+        query = {
+            'search': {
+                'f1':{'field':key, 'type':'is', 'data':''}
+                    }, 
+            'sort': {sort: 'asc'},
+            'join' : join,
+            'start': position
+            }
+        if select is not None:
+            for s_field, s_type, s_data in select:
+                query['search'][s_field+'_'+str(s_data)] = {'field':s_field, 'type':s_type, 'data':s_data}
+        return query
 
 
     def employees(self, key='Id', sort='LastName', join=[]):
@@ -292,6 +1339,89 @@ class Deputy(object):
         return email_employees
 
 
+class AsyncDeputy(object):
+    """
+    An asyncio version of the Deputy API calls, so many resources can be fetched at once.
+
+    Each API call is made by a Deputy object (sharing its connection pool) in a thread pool, so 
+    no more than 'concurrency' calls are in progress at once. Other keyword arguments are passed 
+    to Deputy, e.g. AsyncDeputy(endpoint, token, timeout, cache=cache).
+
+    Raises a DeputyException if there is a problem, otherwise returns a decoded JSON response.
+    """
+
+    def __init__(self, endpoint, token, timeout, concurrency=8, **kwargs):
+        self.deputy      = Deputy(endpoint, token, timeout, pool_size=concurrency, **kwargs)
+        self.concurrency = concurrency
+        self.executor    = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.deputy.close()
+
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+
+    async def api(self, api, method='GET', data=None, dp_meta=False):
+        """
+        See Deputy.api().
+        """
+        return await self.run(self.deputy.api, api, method=method, data=data, dp_meta=dp_meta)
+
+
+    async def resource(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False, fields=None, normalise=False):
+        """
+        See Deputy.resource(). The pages planned by Deputy.page_queries() are requested together.
+        """
+        if self.deputy.store is not None:
+            # the store is read locally, so let Deputy do the work
+            return await self.run(self.deputy.resource, resource_name, key=key, sort=sort, join=join, 
+                select=select, workers=workers, keyset=keyset, fields=fields, normalise=normalise)
+
+        api = 'resource/{0}/QUERY'.format(resource_name)
+        plan = self.deputy.page_queries(resource_name, key=key, sort=sort, join=join, select=select, 
+            workers=workers, keyset=keyset)
+        table = {}
+        result = collections.OrderedDict()
+        queries = next(plan)
+        while True:
+            pages = await asyncio.gather(*[self.api(api, method='POST', data=query) for query in queries])
+            # pages are merged in position order, so the result remains in 'sort' order
+            fetched = []
+            for api_resp in pages:
+                for record in self.deputy.shape(api_resp, key=key, join=join, fields=fields, normalise=normalise, table=table):
+                    result[record[key]] = record
+                if len(api_resp) < self.deputy.PAGE_SIZE:
+                    self.deputy.progress('resource', resource_name, len(result))
+                    return result
+                fetched.append(api_resp)
+            queries = plan.send(fetched)
+
+
+    async def employees(self, key='Id', sort='LastName', join=[]):
+        """
+        See Deputy.employees().
+        """
+        return await self.resource('Employee', key=key, sort=sort, join=join, select=[('Active', 'eq',  True)])
+
+
+    async def employee_by_email(self):
+        """
+        See Deputy.employee_by_email().
+        """
+        employees = await self.employees(join=['ContactObject'])
+        email_employees = collections.OrderedDict()
+        for id in employees:
+            employee = employees[id]
+            email_address = employee['ContactObject']['Email']
+            email_employees[email_address] = employee
+        return email_employees
+
+
 class Printx(object):
     """
     This is a helper class to allows outout to be formated as text or a CSV record.
@@ -342,18 +1472,114 @@ class College(Deputy):
 
     Static Methods:
         parse_student_record — to read an input CSV row, perform fixups, and create a Deputy user creation CSV row.
+        parse_student_records — to do the same for a list of rows at once.
         add_years_to_student_records — to add a student year level as a new TrainingRecord resource.
+        read_students — to parse all import_csv rows into students by email.
+        plan_changes — to compare students with Deputy employees and list the changes needed.
 
     Methods:
 
     """
 
 
-    def __init__(self, endpoint, token, timeout):
+    # The changes found by plan_changes().
+    Plan       = collections.namedtuple('Plan', ['creates', 'deactivations', 'reactivations', 'year_changes', 'unchanged'])
+    YearChange = collections.namedtuple('YearChange', ['employee_id', 'name', 'year', 'training_record_id'])
+
+    def __init__(self, endpoint, token, timeout, parse_cache=None, **kwargs):
         # A function may also return some statistics.
-        self.stats = []
+        self.all_stats = []
+        self.local = threading.local()
         self.Stat = collections.namedtuple('Stat', ['id', 'text', 'value'])
-        super().__init__(endpoint, token, timeout)
+        # resource() results remembered for this run, as a Future for each call (done or still fetching)
+        self.memo = {}
+        self.memo_lock = threading.Lock()
+        # parsed import_csv rows kept between runs
+        self.parse_cache = parse_cache
+        super().__init__(endpoint, token, timeout, **kwargs)
+
+
+    def close(self):
+        """
+        Close the Deputy connections, store and cache, and the parse cache.
+        """
+        super().close()
+        if self.parse_cache is not None:
+            self.parse_cache.close()
+
+
+    @property
+    def stats(self):
+        """
+        The statistics list. A method run in another thread by run_concurrently() adds its statistics 
+        to a list for that thread, which is added here in order once all the methods have finished.
+        """
+        return getattr(self.local, 'stats', self.all_stats)
+
+
+    def run_concurrently(self, *calls):
+        """
+        Run each (function, args, kwargs) call in its own thread and return a list of the results.
+        Statistics are added in the order of the calls, as if they were run one after another.
+
+        May raise DeputyException.
+        """
+        def run(function, args, kwargs):
+            self.local.stats = []
+            try:
+                return (function(*args, **kwargs), self.local.stats)
+            finally:
+                del self.local.stats
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            futures = [executor.submit(run, *call) for call in calls]
+            results = [future.result() for future in futures]
+        for result, stats in results:
+            self.stats.extend(stats)
+        return [result for result, stats in results]
+
+
+    def resource(self, resource_name, key='Id', sort='Id', join=[], select=None, workers=None, keyset=False, fields=None, normalise=False):
+        """
+        Deputy.resource(), remembered so that identical calls during a run are only fetched once.
+        The same OrderedDict is returned to each caller, so it must not be changed. A call made while 
+        an identical one is still fetching (e.g. from run_concurrently()) waits for its result.
+
+        Call invalidate() after changing a resource.
+        """
+        memo_key = json.dumps([resource_name, key, sort, join, select, keyset, fields, normalise], default=str)
+        with self.memo_lock:
+            future = self.memo.get(memo_key)
+            fetching = future is None
+            if fetching:
+                future = concurrent.futures.Future()
+                self.memo[memo_key] = future
+        if not fetching:
+            return future.result()
+        try:
+            result = super().resource(resource_name, key=key, sort=sort, join=join, select=select, 
+                workers=workers, keyset=keyset, fields=fields, normalise=normalise)
+        except BaseException as e:
+            # a failed fetch isn't remembered, but callers already waiting for it get the same error
+            with self.memo_lock:
+                if self.memo.get(memo_key) is future:
+                    del self.memo[memo_key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+    def invalidate(self, resource_name=None):
+        """
+        Forget remembered resource() results for resource_name, or all results if resource_name is None.
+        """
+        with self.memo_lock:
+            if resource_name is None:
+                self.memo.clear()
+            else:
+                for memo_key in [k for k in self.memo if json.loads(k)[0] == resource_name]:
+                    del self.memo[memo_key]
 
 
     @staticmethod
@@ -407,180 +1633,266 @@ class College(Deputy):
         Exceptions:
         3 yes. Missing YearatUni for Mr Wayne C Z for course Biomedicine
         """
-        messages = []
+        return College.parse_student_records([row], include_mobile)[0]
 
-        synergetic_id = row['Student ID'].strip()
-        first_name =    row['Student Preferred'].strip()
-        last_name =     row['Surname'].strip()
-        student_id =    row['Network Login'].strip()
-        email =         row['Trinity Email'].strip()
-        course =        row['Course Description'].strip()
-        year_at_uni =   row['UOMYear'].strip()
-        boarder =       row['Boarder'].strip()
-        mobile =        row['Mobile Phone'].strip()
-        name =          '{0} {1}'.format(first_name, last_name).strip() # allow for students with a single name 
-
-        # Fixup's to cater for poor quality and inconsistent input data.
-
-        # Empty row in the spreadsheet
-        if len(first_name) + len(last_name) + len(student_id) == 0:
-            return (messages, None)
-
-        # Fix missing NetworkLogin (assume email is OK in this instance)
-        if len(student_id) == 0:
-            if len(email) == 0:
-                student_id = None
-                messages.append('Excluded {0} (Student ID: {1}) for Missing NetworkLogin and/or Trinity Email.'.format(name, synergetic_id))
-                return (messages, None)
-            else:
-                student_id = email.split('@')[0]
-                messages.append('Missing NetworkLogin for {0}. Setting to {1} using email {2}.'.format(name, student_id, email))
 
-        # exclude some users (with potential include exceptions)
-        if student_id in exclude_list:
-            if student_id in include_list:
-                print('include (1)', student_id)
-            else:
-                messages.append('Excluded {0} ({1}) who is on the exclude list.'.format(name, student_id, course))
-                return (messages, None)
+    # Patterns used by parse_student_records(), compiled once.
+    MOBILE_COUNTRY_CODE = re.compile(r'^\+?61')
+
+    @staticmethod
+    def parse_student_records(rows, include_mobile=False):
+        """
+        Parse a list of rows from the input CSV file, applying the same rules as parse_student_record().
+
+        Returns a list of (messages, row) tuples, one for each input row.
 
-        if year_at_uni == 'Not Selected':
-            # Make this a fatal error -- need to fix the data rather than ignore the student.
-            sys.exit('Fatal Error. {0} ({1}), Year at Uni = Not Selected.'.format(name, student_id, year_at_uni, course))
-            year = None
+        The exclude and include lists are converted to sets, and the postgrad courses to a single 
+        regular expression, once for all the rows.
+        """
+        exclude_ids = set(exclude_list)
+        include_ids = set(include_list)
+        if len(exclude_postgrad) > 0:
+            postgrad = re.compile('|'.join(re.escape(e) for e in exclude_postgrad))
         else:
+            postgrad = None
+
+        results = []
+        for row in rows:
+            messages = []
+
+            synergetic_id = row['Student ID'].strip()
+            first_name =    row['Student Preferred'].strip()
+            last_name =     row['Surname'].strip()
+            student_id =    row['Network Login'].strip()
+            email =         row['Trinity Email'].strip()
+            course =        row['Course Description'].strip()
+            year_at_uni =   row['UOMYear'].strip()
+            boarder =       row['Boarder'].strip()
+            mobile =        row['Mobile Phone'].strip()
+            name =          '{0} {1}'.format(first_name, last_name).strip() # allow for students with a single name 
+
+            # Fixup's to cater for poor quality and inconsistent input data.
+
+            # Empty row in the spreadsheet
+            if len(first_name) + len(last_name) + len(student_id) == 0:
+                results.append((messages, None))
+                continue
 
-            # year 1,2,3,1NR assignment        
-            try:
-                # year_at_uni data contains "4 Years" and "1 Year"
-                year_at_uni = year_at_uni.split(' ')[0]
+            # Fix missing NetworkLogin (assume email is OK in this instance)
+            if len(student_id) == 0:
+                if len(email) == 0:
+                    student_id = None
+                    messages.append('Excluded {0} (Student ID: {1}) for Missing NetworkLogin and/or Trinity Email.'.format(name, synergetic_id))
+                    results.append((messages, None))
+                    continue
+                else:
+                    student_id = email.split('@')[0]
+                    messages.append('Missing NetworkLogin for {0}. Setting to {1} using email {2}.'.format(name, student_id, email))
 
-                if boarder == 'Non Res Special':
-                    year ='Year1NR'
+            # exclude some users (with potential include exceptions)
+            if student_id in exclude_ids:
+                if student_id in include_ids:
+                    print('include (1)', student_id)
                 else:
-                    if int(year_at_uni) > 3:
-                        messages.append('Excluded {0} ({1}), Year at Uni {2} > 3 in course {3}.'.format(name, student_id, year_at_uni, course))
-                        return (messages, None)
-                    year = 'Year{0}'.format(year_at_uni)
+                    messages.append('Excluded {0} ({1}) who is on the exclude list.'.format(name, student_id, course))
+                    results.append((messages, None))
+                    continue
 
-            except ValueError:
-                messages.append('Missing UOMYear for {0} ({1}). Setting to blank.'.format(name, student_id, course))
+            if year_at_uni == 'Not Selected':
+                # Make this a fatal error -- need to fix the data rather than ignore the student.
+                sys.exit('Fatal Error. {0} ({1}), Year at Uni = Not Selected.'.format(name, student_id, year_at_uni, course))
                 year = None
+            else:
 
-            except:
-                sys.exit('Fatal Error. Unknown value for UOMYear for {0} ({1}).'.format(name, student_id, course))
+                # year 1,2,3,1NR assignment        
+                try:
+                    # year_at_uni data contains "4 Years" and "1 Year"
+                    year_at_uni = year_at_uni.split(' ')[0]
+
+                    if boarder == 'Non Res Special':
+                        year ='Year1NR'
+                    else:
+                        if int(year_at_uni) > 3:
+                            messages.append('Excluded {0} ({1}), Year at Uni {2} > 3 in course {3}.'.format(name, student_id, year_at_uni, course))
+                            results.append((messages, None))
+                            continue
+                        year = 'Year{0}'.format(year_at_uni)
+
+                except ValueError:
+                    messages.append('Missing UOMYear for {0} ({1}). Setting to blank.'.format(name, student_id, course))
+                    year = None
+
+                except:
+                    sys.exit('Fatal Error. Unknown value for UOMYear for {0} ({1}).'.format(name, student_id, course))
 
-        # exclude postgrads
-        for e in exclude_postgrad:
-            if e in course:
+            # exclude postgrads
+            if postgrad is not None and postgrad.search(course):
                 messages.append('Excluded {0} ({1}) for Post Grad course {2}.'.format(name, student_id, course))
-                return (messages, None)
+                results.append((messages, None))
+                continue
 
-        # fix Mobile phone number
-        if len(mobile) == 0:
-            messages.append('Missing phone number for {0} ({1}).'.format(name, student_id))
-            mobile = None
-        else:
-            mobile = mobile.replace(' ', '')
-            mobile = re.sub('^\+61', '0', mobile)
-            mobile = re.sub('^61', '0', mobile)
-            if mobile.startswith('00') or mobile.startswith('+'):
-                messages.append('International phone number for {0} ({1}): {2}. Setting to Blank.'.format(name, student_id, mobile))
-                mobile = ''
+            # fix Mobile phone number
+            if len(mobile) == 0:
+                messages.append('Missing phone number for {0} ({1}).'.format(name, student_id))
+                mobile = None
             else:
-                # Excel sometimes drops the leading zero.
-                if len(mobile) is 9:
-                    mobile = '0' + mobile
-                # An Australian mobile number must be 10 characters long.
-                if len(mobile) is not 10:
-                    messages.append('Incorrect mobile number for {0} ({1}): {2}. Setting to Blank.'.format(name, student_id, mobile))
+                mobile = College.MOBILE_COUNTRY_CODE.sub('0', mobile.replace(' ', ''), count=1)
+                if mobile.startswith('00') or mobile.startswith('+'):
+                    messages.append('International phone number for {0} ({1}): {2}. Setting to Blank.'.format(name, student_id, mobile))
                     mobile = ''
                 else:
-                    mobile = '{0} {1} {2}'.format(mobile[0:4],mobile[4:7], mobile[7:10])
-
-        # fix email address
-        if email_test is not None:
-            if email_test not in email:
-                messages.append('Missing or incorrect {0} email address {1} ({2}): {3}. Fixing.'.format(email_test, name, student_id, email))
-                if email_domain is not None:
-                    email = '{0}@{1}'.format(student_id, email_domain)
-                else:
-                    email = None
-
-        # create the new row
-        new_row = {
-            'synergetic_id':    synergetic_id,
-            'first_name':       first_name,
-            'last_name':        last_name,
-            'student_id':       student_id,
-            'email':            email,
-            'year':             year,
-            'mobile':           mobile
-            }
+                    # Excel sometimes drops the leading zero.
+                    if len(mobile) == 9:
+                        mobile = '0' + mobile
+                    # An Australian mobile number must be 10 characters long.
+                    if len(mobile) != 10:
+                        messages.append('Incorrect mobile number for {0} ({1}): {2}. Setting to Blank.'.format(name, student_id, mobile))
+                        mobile = ''
+                    else:
+                        mobile = '{0} {1} {2}'.format(mobile[0:4],mobile[4:7], mobile[7:10])
+
+            # fix email address
+            if email_test is not None:
+                if email_test not in email:
+                    messages.append('Missing or incorrect {0} email address {1} ({2}): {3}. Fixing.'.format(email_test, name, student_id, email))
+                    if email_domain is not None:
+                        email = '{0}@{1}'.format(student_id, email_domain)
+                    else:
+                        email = None
+
+            # create the new row
+            new_row = {
+                'synergetic_id':    synergetic_id,
+                'first_name':       first_name,
+                'last_name':        last_name,
+                'student_id':       student_id,
+                'email':            email,
+                'year':             year,
+                'mobile':           mobile
+                }
+            results.append((messages, new_row))
 
-        return (messages, new_row)
+        return results
 
 
-    def add_years_to_student_records(self, years, student_years, csv_reader, test=False):
+    def read_students(self, csv_reader, include_mobile=False, excluded_messages=True, fingerprint=None):
         """
-        Add the student year level as a training module for each student found in the import_csv file.
-        A training module is used because it is conveniently placed in the Deputy UI for Employee's.
+        Parse every row of the import_csv file with parse_student_records().
 
-        The year level will not be changed if it is correct. It will be changed if it is different in 
-        the CSV. It will be added if currently not specified.
+        Returns a tuple (messages, students), where messages are the parse processing messages and 
+        students is an OrderedDict of parsed rows with the email as the key.
+        A student listed more than once is only included once.
 
-        student_years = {employee_id: year_text}. For example, year_text=Year2
+        If excluded_messages is False, messages for excluded rows are not returned.
 
-        Anyone excluded by parse_student_record() will NOT be updated, e.g. TCAC members and co-ordinators
-
-        Returns an array of processing messages.
+        If there is a parse_cache and the fingerprint of the import_csv file is given, a file that was 
+        parsed by an earlier run with the same configuration is not read or parsed again.
 
-        May raise DeputyException.
+        May raise KeyError if an import_csv column is missing.
         """
-        messages = []
-
-        employees = self.employee_by_email()
+        cached = self.parse_cache is not None and fingerprint is not None
+        parsed = None
+        if cached:
+            key = self.parse_cache.key(fingerprint, include_mobile, exclude_list, include_list, exclude_postgrad, 
+                email_test, email_domain)
+            parsed = self.parse_cache.get(key)
+        if parsed is None:
+            parsed = self.parse_student_records(list(csv_reader), include_mobile)
+            if cached:
+                self.parse_cache.put(key, parsed)
 
-        count = 0
-        not_found_count = 0
-        already_count = 0
-        added_count = 0
-        for in_row in csv_reader:
-            # parse record but discard any messages
-            (row_messages, parsed_row) = self.parse_student_record(in_row)
-            if parsed_row is None:
+        messages = []
+        students = collections.OrderedDict()
+        for (row_messages, parsed_row) in parsed:
+            if parsed_row is not None:
+                students[parsed_row['email']] = parsed_row
+            elif not excluded_messages:
                 continue
             messages.extend(row_messages)
+        return (messages, students)
 
-            email = parsed_row['email']
-            name = '{0} {1}'.format(parsed_row['first_name'], parsed_row['last_name'])
 
-            if email not in employees:
-                messages.append('Not Found: {0} ({1})'.format(name, email))
-                not_found_count += 1
+    def plan_changes(self, students, employees_by_email={}, discarded_by_email={}, student_years={}):
+        """
+        Compare the students from read_students() with Deputy employees and return a Plan of:
+            creates       -- students (parsed rows) who are not in employees_by_email
+            deactivations -- employees in employees_by_email with a year level who are not students
+            reactivations -- employees in discarded_by_email with a year level who are students
+            year_changes  -- a YearChange for each student in employees_by_email whose year level 
+                             is missing or different in student_years
+            unchanged     -- employee ids of students whose year level is already correct
+
+        employees_by_email and discarded_by_email are from employee_by_email() and 
+        discarded_employee_by_email(), and student_years from student_years().
+        Each list is made in a single pass using dict lookups.
+        """
+        plan = self.Plan([], [], [], [], [])
+
+        for email in students:
+            student = students[email]
+            if email not in employees_by_email:
+                plan.creates.append(student)
+                continue
+            employee_id = employees_by_email[email]['Id']
+            if student['year'] is None:
                 continue
+            name = '{0} {1}'.format(student['first_name'], student['last_name'])
+            if employee_id not in student_years:
+                plan.year_changes.append(self.YearChange(employee_id, name, student['year'], None))
+            elif student_years[employee_id][0] == student['year']:
+                plan.unchanged.append(employee_id)
+            else:
+                plan.year_changes.append(self.YearChange(employee_id, name, student['year'], student_years[employee_id][1]))
 
-            count += 1
-            employee = employees[email]
-            employee_id = employee['Id']
+        for email in employees_by_email:
+            if email not in students and employees_by_email[email]['Id'] in student_years:
+                plan.deactivations.append(employees_by_email[email])
 
-            year = parsed_row['year']
+        for email in discarded_by_email:
+            if email in students and discarded_by_email[email]['Id'] in student_years:
+                plan.reactivations.append(discarded_by_email[email])
 
-            if year is None:
-                continue
+        return plan
 
-            # dont add year if one already exists and is the correct year
-            # print(employee_id, employee_id in student_years, student_years[employee_id][0], year)
-            if employee_id in student_years:
-                if student_years[employee_id][0] == year:
-                    already_count += 1
-                    continue
-                else:
-                    # remove incorrect year
-                    if test:
-                        messages.append(f'[test] Deleted old year for {name} ({employee_id})')
-                    else:
-                        api_resp = college.api('resource/TrainingRecord/{0}'.format(student_years[employee_id][1]), method='DELETE')
+
+    def add_years_to_student_records(self, years, student_years, csv_reader, test=False, workers=None, fingerprint=None):
+        """
+        Add the student year level as a training module for each student found in the import_csv file.
+        A training module is used because it is conveniently placed in the Deputy UI for Employee's.
+
+        The year level will not be changed if it is correct. It will be changed if it is different in 
+        the CSV. It will be added if currently not specified.
+
+        student_years = {employee_id: year_text}. For example, year_text=Year2
+
+        Anyone excluded by parse_student_record() will NOT be updated, e.g. TCAC members and co-ordinators
+
+        The changes are made by bulk() using 'workers' threads (default self.write_workers), deleting any old 
+        year before the new one is added. 'fingerprint' is passed to read_students().
+
+        Returns an array of processing messages.
+
+        May raise DeputyException.
+        """
+        employees = self.employee_by_email()
+        (messages, students) = self.read_students(csv_reader, excluded_messages=False, fingerprint=fingerprint)
+        plan = self.plan_changes(students, employees_by_email=employees, student_years=student_years)
+
+        for student in plan.creates:
+            messages.append('Not Found: {0} {1} ({2})'.format(student['first_name'], student['last_name'], student['email']))
+
+        mutations = []
+        for change in plan.year_changes:
+            employee_mutations = []
+            name = change.name
+            employee_id = change.employee_id
+            year = change.year
+            if change.training_record_id is not None:
+                # remove incorrect year
+                if test:
+                    messages.append(f'[test] Deleted old year for {name} ({employee_id})')
+                employee_mutations.append(self.Mutation(name, 
+                    'resource/TrainingRecord/{0}'.format(change.training_record_id), 'DELETE', None))
 
             training_module = years[year]
             if test:
@@ -594,18 +1906,33 @@ class College(Deputy):
                'TrainingDate': datetime.datetime.now().isoformat(),
                'Active': True
             }
-            if not test:
-                api_resp = self.api('resource/TrainingRecord', method='POST', data=data)
-            added_count += 1
+            employee_mutations.append(self.Mutation(name, 'resource/TrainingRecord', 'POST', data))
+            mutations.append(employee_mutations)
 
-        messages.append('Processed {0} students.'.format(count))
-        messages.append('{0} students not found in Deputy.'.format(not_found_count))
-        messages.append('{0} students already had a year level set.'.format(already_count))
+        added_count = 0
+        failed_count = 0
+        if test:
+            added_count = len(mutations)
+        else:
+            for result in self.bulk(mutations, workers=workers):
+                if not result.ok:
+                    messages.append('Failed to {0} {1} for {2}: {3}'.format(result.method, result.api, result.key, result.response))
+                    failed_count += 1
+                elif result.method == 'POST':
+                    added_count += 1
+            self.invalidate('TrainingRecord')
+
+        messages.append('Processed {0} students.'.format(len(students) - len(plan.creates)))
+        messages.append('{0} students not found in Deputy.'.format(len(plan.creates)))
+        messages.append('{0} students already had a year level set.'.format(len(plan.unchanged)))
         messages.append('Added year level to {0} students.'.format(added_count))
+        if failed_count > 0:
+            messages.append('{0} changes failed.'.format(failed_count))
         return messages
 
 
-    def delete_users(self, employees_by_email, student_years, csv_reader, use_csv=True, test=False):
+    def delete_users(self, employees_by_email, student_years, csv_reader, use_csv=True, test=False, journal=None, 
+            fingerprint=None):
         """
         Delete (i.e. set active to false) any student who is not in import_csv.
 
@@ -619,47 +1946,51 @@ class College(Deputy):
         May raise DeputyException.
 
         if use_csv is False then don't check students in the CSV file. Useful for end of year processing.
+
+        If a MutationJournal is given, students deleted by an earlier run that stopped part way are skipped.
+        'fingerprint' is passed to read_students().
         """
         messages = []
 
         deleted_count = 0
-
-        student_by_email = {}
+        mutations = []
 
         if use_csv:
+            # parse records but discard any messages
+            (parse_messages, student_by_email) = self.read_students(csv_reader, fingerprint=fingerprint)
+        else:
+            student_by_email = {}
 
-            for in_row in csv_reader:
-                # parse record but discard any messages
-                (messages, parsed_row) = self.parse_student_record(in_row)
-                if parsed_row is None:
-                    continue
-
-                email = parsed_row['email']
-                name = '{0} {1}'.format(parsed_row['first_name'], parsed_row['last_name'])
-                student_by_email[email] = name
+        plan = self.plan_changes(student_by_email, employees_by_email=employees_by_email, student_years=student_years)
+        for student in plan.deactivations:
+            student_id = student['Id']
+            student_name = student['DisplayName']
+            if test:
+                messages.append(f'[test] Deleted student: {student_name} {student_id}')
+                deleted_count += 1
+            else:
+                mutations.append([self.Mutation(f'{student_name} {student_id}', 
+                    f'resource/Employee/{student_id}', 'POST', {'Active': False})])
 
-        for employee_email in employees_by_email:
-            if employee_email not in student_by_email: 
-                student = employees_by_email[employee_email]
-                student_id = student['Id']
-                student_name = student['DisplayName']
-                if student_id in student_years:
-                    #print(student_id, student_name, student_years[student_id][0])
-                    #print(json.dumps(student, sort_keys=True, indent=4, separators=(',', ': ')))
-                    if test:
-                        messages.append(f'[test] Deleted student: {student_name} {student_id}')
-                    else:
-                        messages.append(f'Deleted student: {student_name} {student_id}')
-                        api_resp = college.api(f'resource/Employee/{student_id}', method='POST', data={'Active': False})
-                    #messages.append('API response: {0}'.format(api_resp))
-                    deleted_count += 1
+        if not test:
+            for result in self.bulk(mutations, journal=journal):
+                if not result.ok:
+                    messages.append(f'Failed to delete student: {result.key}: {result.response}')
+                    continue
+                if result.response is None:
+                    messages.append(f'Deleted student: {result.key} (by an earlier run)')
+                else:
+                    messages.append(f'Deleted student: {result.key}')
+                #messages.append('API response: {0}'.format(result.response))
+                deleted_count += 1
+            self.invalidate('Employee')
 
         messages.append('Processed {0} students.'.format(len(student_by_email)))
         messages.append('{0} students deleted.'.format(deleted_count))
         return messages
 
 
-    def reinstate_users(self, employees_by_email, student_years, csv_reader, test=True):
+    def reinstate_users(self, employees_by_email, student_years, csv_reader, test=True, journal=None, fingerprint=None):
         """
         Reinstate (i.e. set active to true) any student who is in import_csv.
 
@@ -668,38 +1999,42 @@ class College(Deputy):
         -- must be in input_csv (student_by_email)
         -- must have a Year1/Year2/Year3/Year1NR training record
 
+        employees_by_email are the discarded employees, e.g. from discarded_employee_by_email().
+
         Returns an array of processing messages.
 
         May raise DeputyException.
+
+        If a MutationJournal is given, students reinstated by an earlier run that stopped part way are skipped.
+        'fingerprint' is passed to read_students().
         """
         messages = []
 
         reinstated_count = 0
+        mutations = []
 
-        # Get a list of students
-        student_by_email = {}
-        for in_row in csv_reader:
-            # parse record but discard any messages
-            (messages, parsed_row) = self.parse_student_record(in_row)
-            if parsed_row is None:
-                continue
+        # Get a list of students, but discard any messages
+        (parse_messages, student_by_email) = self.read_students(csv_reader, fingerprint=fingerprint)
 
-            email = parsed_row['email']
-            name = '{0} {1}'.format(parsed_row['first_name'], parsed_row['last_name'])
-            student_by_email[email] = name
+        plan = self.plan_changes(student_by_email, discarded_by_email=employees_by_email, student_years=student_years)
+        for student in plan.reactivations:
+            student_id = student['Id']
+            student_name = student['DisplayName']
+            mutations.append([self.Mutation('{0} {1}'.format(student_name, student_id), 
+                'resource/Employee/{0}'.format(student_id), 'POST', {'Active': True})])
 
-        for employee_email in employees_by_email:
-            if employee_email in student_by_email: 
-                student = employees_by_email[employee_email]
-                student_id = student['Id']
-                student_name = student['DisplayName']
-                if student_id in student_years:
-                    #print(student_id, student_name, student_years[student_id][0])
-                    #print(json.dumps(student, sort_keys=True, indent=4, separators=(',', ': ')))
-                    messages.append('Reinstated student: {0} {1}'.format(student_name, student_id))
-                    api_resp = college.api('resource/Employee/{0}'.format(student_id), method='POST', data={'Active': True})
-                    messages.append('API response: {0}'.format(api_resp))
-                    reinstated_count += 1
+        for result in self.bulk(mutations, journal=journal):
+            if not result.ok:
+                messages.append('Failed to reinstate student: {0}: {1}'.format(result.key, result.response))
+                continue
+            if result.response is None:
+                messages.append('Reinstated student: {0} (by an earlier run)'.format(result.key))
+            else:
+                messages.append('Reinstated student: {0}'.format(result.key))
+                messages.append('API response: {0}'.format(result.response))
+            reinstated_count += 1
+
+        self.invalidate('Employee')
 
         messages.append('Processed {0} students.'.format(len(student_by_email)))
         messages.append('{0} students reinstated.'.format(reinstated_count))
@@ -832,42 +2167,51 @@ class College(Deputy):
         return result
 
 
+    def location_select(self, location_name):
+        """
+        Return a search term selecting the OperationalUnit's of the location (the Company with 
+        CompanyName location_name), or an empty list if location_name is None.
+        The Company and OperationalUnit resources are remembered for the run.
+        """
+        if location_name is None:
+            return []
+        companies = self.resource('Company', select=[('CompanyName', 'eq', location_name)])
+        units = self.resource('OperationalUnit', select=[('Company', 'in', list(companies))])
+        return [('OperationalUnit', 'in', list(units))]
+
+
     def student_timesheet_count(self, location_name, start_date=None, end_date=None):
         """
         Return a count of approved and non-approved, non-leave timesheets by employee_id.
-        Timesheets are selected by Date (yyyy-mm-dd) between start_date and end_date.
+        Timesheets are selected by Date (yyyy-mm-dd) between start_date and end_date, and 
+        by the OperationalUnit's of location_name.
         """
-        timesheets = self.resource('Timesheet', join=['OperationalUnitObject'], 
-            select=[
-                ('Employee', 'ne',  0),
-                ('Date', 'ge',  start_date),
-                ('Date', 'le',  end_date)
-            ])
         students = Counter()
         students.add_counter('timesheet', 'Timesheet')
         students.add_counter('approved_timesheet', 'Approved Timesheet')
 
-        for id in timesheets:
-            timesheet = timesheets[id]
+        location = self.location_select(location_name)
+        if location and len(location[0][2]) == 0:
+            # no such location
+            return students
 
-            # ignore if there is no location or it's not a match
-            if location_name is not None:
-                if timesheet['OperationalUnitObject']['CompanyName'] != location_name:
-                    continue
+        fields = ['Employee', 'IsLeave', 'TimeApproved']
+        timesheets = Columns(self.iter_resource('Timesheet', keyset=True, fields=fields,
+            select=[
+                ('Employee', 'ne',  0),
+                ('Date', 'ge',  start_date),
+                ('Date', 'le',  end_date)
+            ] + location), fields=fields)
 
-            # # make sure someone approved then
-            # if not timesheet['TimeApproved']:
-            #     continue
- 
-            # make sure they are not a leave timesheet
-            if timesheet['IsLeave']:
-                continue
+        (employees, is_leave, time_approved) = [timesheets.column(field) for field in fields]
 
-            employee_id = timesheet['Employee']
-            students.count(employee_id, 'timesheet')
-            
-            if timesheet['TimeApproved']:
-                students.count(employee_id, 'approved_timesheet')
+        # make sure they are not a leave timesheet
+        not_leave = [not leave for leave in is_leave]
+        students.count_many(itertools.compress(employees, not_leave), 'timesheet')
+
+        # count the approved ones as well
+        students.count_many(itertools.compress(employees, 
+            [not leave and approved for leave, approved in zip(is_leave, time_approved)]), 'approved_timesheet')
 
         return students
 
@@ -877,42 +2221,38 @@ class College(Deputy):
         Return a count of approved, non-leave timesheets by Employee for the selected location.
         Employee may be for an inactive employee.
         Employee is ignored if it is zero.
-        Rosters are selected by Date (yyyy-mm-dd) between start_date and end_date.
+        Rosters are selected by Date (yyyy-mm-dd) between start_date and end_date, and by the 
+        OperationalUnit's of location_name.
         """
-        rosters = self.resource('Roster', join=['OperationalUnitObject'], 
-            select=[
-                ('Employee', 'ne',  0),
-                ('Date', 'ge',  start_date),
-                ('Date', 'le',  end_date)
-            ])
-
         students = Counter()
         students.add_counter('rostered',  'Rosters Rostered')
         students.add_counter('completed', 'Rosters Completed')
         students.add_counter('open',      'Rosters Open')
 
-        for id in rosters:
-            roster = rosters[id]
-
-            # ignore if there is no location or it's not a match
-            if location_name is not None:
-                if roster['OperationalUnitObject']['CompanyName'] != location_name:
-                    continue
-
-            employee_id = roster['Employee']
-            timesheet = roster['MatchedByTimesheet']
-            students.count(employee_id, 'rostered')
+        fields = ['Employee', 'MatchedByTimesheet', 'Open']
+        location = self.location_select(location_name)
+        if location and len(location[0][2]) == 0:
+            # no such location
+            rosters = Columns(fields=fields)
+        else:
+            rosters = Columns(self.iter_resource('Roster', keyset=True, fields=fields,
+                select=[
+                    ('Employee', 'ne',  0),
+                    ('Date', 'ge',  start_date),
+                    ('Date', 'le',  end_date)
+                ] + location), fields=fields)
 
-            if timesheet > 0:
-                students.count(employee_id, 'completed')
-            if roster['Open']:
-                students.count(employee_id, 'open')
+        roster_count = len(rosters)
+        (employees, timesheets, roster_open) = [rosters.column(field) for field in fields]
 
-            # if employee_id == 1022:
-            #     print(employee_id, students[1022])
-            #     print(roster, '\n\n')
+        students.count_many(employees, 'rostered')
+        students.count_many(itertools.compress(employees, [timesheet > 0 for timesheet in timesheets]), 'completed')
+        students.count_many(itertools.compress(employees, roster_open), 'open')
 
-        self.stats.append(self.Stat('rosters',   'Rosters (for all locations)',   len(rosters)))
+        if location_name is None:
+            self.stats.append(self.Stat('rosters',   'Rosters (for all locations)',   roster_count))
+        else:
+            self.stats.append(self.Stat('rosters',   'Rosters (for {0})'.format(location_name),   roster_count))
         self.stats.append(self.Stat('students',  'Rosters with Students',  len(students)))
         for total in students.get_totals():
             self.stats.append(self.Stat(*total))
@@ -925,16 +2265,15 @@ class College(Deputy):
         Rosters are selected by Date between start_date and end_date.
         """
  
+        # These are independent so they are fetched at the same time:
         # fetch 'Student', ['Id', 'Name', 'Year', 'Email']
-        students = self.bursary_student_list(include_list)
-
         # count approved and non-approved, non-leave 'timesheet'
-        student_timesheet_count = self.student_timesheet_count(location_name, start_date=start_date, end_date=end_date)
-
         # count 'rostered', 'completed', 'open' rosters
-        student_roster_count = self.student_roster_count(location_name, start_date=start_date, end_date=end_date)
-        roster_stats = self.stats
-        #print(json.dumps(roster_stats, indent=4, separators=(',', ': ')))
+        dates = {'start_date': start_date, 'end_date': end_date}
+        students, student_timesheet_count, student_roster_count = self.run_concurrently(
+            (self.bursary_student_list,    (include_list,),  {}),
+            (self.student_timesheet_count, (location_name,), dates),
+            (self.student_roster_count,    (location_name,), dates))
         
         Report = collections.namedtuple('Report', ['Name', 'Year', 'Obligation', 'Rostered', 'Open', 'Completed', 
                 'PercentRostered', 'PercentCompleted', 'Issues', 'Email', 'Timesheets', 'ApprovedTimesheets'])
@@ -1006,110 +2345,237 @@ class College(Deputy):
         return result
 
 
-def sync_with_sheet(endpoint, token, timeout, sheet, shift_obligations, location_name, include_list, start, end):
-    college = College(endpoint, token, timeout)
+def sync_with_sheet(endpoint, token, timeout, sheet, shift_obligations, location_name, include_list, start, end, 
+        college=None, **kwargs):
+    # kwargs are passed to College, e.g. workers=4, unless an open college is given (which is left open)
+    close_college = college is None
+    if college is None:
+        college = College(endpoint, token, timeout, **kwargs)
+
+    # fetch the Deputy data while the sheet is read
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    report = executor.submit(college.student_report, shift_obligations, location_name, include_list, 
+        start_date=start, end_date=end)
+    executor.shutdown(wait=False)
 
     worksheet_tally = sheet.worksheet('Tally')
     worksheet_stats = sheet.worksheet('Stats')
 
-    header = worksheet_tally.row_values(1)
+    # read the whole Tally sheet at once
+    tally_values = worksheet_tally.get_all_values()
+    header = tally_values[0]
 
     email_col = header.index('Trinity Email') + 1
-    email_col_values = worksheet_tally.col_values(email_col)[1:]
+    email_col_values = [row_values[email_col - 1] for row_values in tally_values[1:]]
+
+    # email addresses are matched ignoring case and spaces
+    def email_key(email):
+        return email.strip().lower()
+
+    tally_emails = set(email_key(email) for email in email_col_values)
 
     #status_col = header.index('Status') + 1
-    uni_year_col      = header.index('Uni Year') + 1
-    obligation_col    = header.index('Obligation') + 1
-    booked_col        = header.index('Booked') + 1
-    completed_col     = header.index('Completed') + 1
-    timesheets_col    = header.index('Timesheets') + 1
-    approved_timesheets_col = header.index('Approved Timesheets') + 1
+    # Tally column for each Report field
+    report_cols = [
+        (header.index('Uni Year') + 1,            'Year'),
+        (header.index('Obligation') + 1,          'Obligation'),
+        (header.index('Booked') + 1,              'Rostered'),
+        (header.index('Completed') + 1,           'Completed'),
+        (header.index('Timesheets') + 1,          'Timesheets'),
+        (header.index('Approved Timesheets') + 1, 'ApprovedTimesheets'),
+        ]
 
     students = {}
     email_address_mismatch = 0
-    for student in college.student_report(shift_obligations, location_name, include_list, start_date=start, end_date=end):
-        if student.Email in email_col_values:
-            students[student.Email] = student
+    for student in report.result():
+        if email_key(student.Email) in tally_emails:
+            students[email_key(student.Email)] = student
         else:
             print('Email address mismatch', student.Name, student.Email)
             email_address_mismatch += 1
 
-    uni_year_list   = []
-    obligation_list = []
-    booked_list     = []
-    completed_list  = []
-    timesheets_list = []
-    approved_timesheets_list = []
+    def changed(values, row, col, value):
+        # compare with the value read from the sheet, which is always a string
+        current = values[row - 1][col - 1] if row <= len(values) and col <= len(values[row - 1]) else ''
+        return current != ('' if value is None else str(value))
+
+    # only the changed cells are written, row by row, with a single update_cells() for all Tally columns
+    tally_cells = []
 
     row = 2     # 1 offset and skip header row
     processed_students = 0
     not_processed_students = 0
 
     for email in email_col_values:
-        if email in students:
-            student = students[email]
-            uni_year_list.append(gspread.models.Cell(row, uni_year_col, value=student.Year))
-            obligation_list.append(gspread.models.Cell(row, obligation_col, value=student.Obligation))
-            booked_list.append(gspread.models.Cell(row, booked_col, value=student.Rostered))
-            completed_list.append(gspread.models.Cell(row, completed_col, value=student.Completed))
-            timesheets_list.append(gspread.models.Cell(row, timesheets_col, value=student.Timesheets))
-            approved_timesheets_list.append(gspread.models.Cell(row, approved_timesheets_col, value=student.ApprovedTimesheets))
+        student = students.get(email_key(email))
+        if student is not None:
+            for col, field in report_cols:
+                value = getattr(student, field)
+                if changed(tally_values, row, col, value):
+                    tally_cells.append(gspread.models.Cell(row, col, value=value))
             processed_students += 1
         else:
-            uni_year_list.append(gspread.models.Cell(row, uni_year_col, value=''))
-            obligation_list.append(gspread.models.Cell(row, obligation_col, value=''))
-            booked_list.append(gspread.models.Cell(row, booked_col, value=''))
-            completed_list.append(gspread.models.Cell(row, completed_col, value=''))
-            timesheets_list.append(gspread.models.Cell(row, timesheets_col, value=''))
-            approved_timesheets_list.append(gspread.models.Cell(row, approved_timesheets_col, value=''))
+            for col, field in report_cols:
+                if changed(tally_values, row, col, ''):
+                    tally_cells.append(gspread.models.Cell(row, col, value=''))
             not_processed_students += 1
 
         row += 1
 
     #print('Processed rows:', row - 2)
-    worksheet_tally.update_cells(uni_year_list)
-    worksheet_tally.update_cells(obligation_list)
-    worksheet_tally.update_cells(booked_list)
-    worksheet_tally.update_cells(completed_list)
-    worksheet_tally.update_cells(timesheets_list)
-    worksheet_tally.update_cells(approved_timesheets_list)
-
-    last_updated_cell = worksheet_stats.find('Processed')
-    worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, processed_students)
-    #print('Processed Students', processed_students)
-
-    # last_updated_cell = worksheet_stats.find('Included')
-    # worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, len(include_list))
-    # print('Included Students', len(exclude_list))
-
-    # last_updated_cell = worksheet_stats.find('Excluded')
-    # worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, len(exclude_list))
-    # print('Excluded Students', len(include_list))
-
-    # last_updated_cell = worksheet_stats.find('Postgrad')
-    # worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, len(exclude_postgrad))
-    # print('Postgrad Students', len(exclude_postgrad))
-
-    last_updated_cell = worksheet_stats.find('Not Processed')
-    worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, not_processed_students)
-    #print('Not Processed', not_processed_students)
-
-    last_updated_cell = worksheet_stats.find('Email address mismatch')
-    worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, email_address_mismatch)
-    #print('Email address mismatch', email_address_mismatch)
-
-    last_updated_cell = worksheet_stats.find('Last updated UTC')
+    if len(tally_cells) > 0:
+        worksheet_tally.update_cells(tally_cells)
+
+    # Each Stats value is written to the right of its label, e.g. 'Processed'.
+    # The labels are found with a single read and the values written with a single update_cells().
+    stats = worksheet_stats.get_all_values()
+    stats_labels = {}
+    for stats_row, row_values in enumerate(stats, 1):
+        for stats_col, value in enumerate(row_values, 1):
+            stats_labels.setdefault(value, (stats_row, stats_col))
+
     last_updated_value = datetime.datetime.utcnow().isoformat().split('.')[0]
-    worksheet_stats.update_cell(last_updated_cell.row, last_updated_cell.col + 1, last_updated_value)
-    #print('Last updated', last_updated_value)
+    stats_values = [
+        ('Processed',              processed_students),
+        # ('Included',             len(include_list)),
+        # ('Excluded',             len(exclude_list)),
+        # ('Postgrad',             len(exclude_postgrad)),
+        ('Not Processed',          not_processed_students),
+        ('Email address mismatch', email_address_mismatch),
+        ('Last updated UTC',       last_updated_value),
+        ]
+    stats_cells = []
+    for label, value in stats_values:
+        if label in stats_labels:
+            (stats_row, stats_col) = stats_labels[label]
+            if changed(stats, stats_row, stats_col + 1, value):
+                stats_cells.append(gspread.models.Cell(stats_row, stats_col + 1, value=value))
+        else:
+            print('Stats label not found', label)
+    if len(stats_cells) > 0:
+        worksheet_stats.update_cells(stats_cells)
+
+    if close_college:
+        college.close()
 
     return {'processed_rows':row - 2, 
             'processed_students':processed_students, 
             'not_processed_students':not_processed_students,
             'email_address_mismatch':email_address_mismatch,
+            'changed_cells':len(tally_cells) + len(stats_cells),
             'last_updated':last_updated_value}
 
 
+class ReportServer(http.server.ThreadingHTTPServer):
+    """
+    A local HTTP server for the report, list and journal results, e.g. http://localhost:8080/report?format=csv
+
+    The results are kept in memory, so requests are answered without calling Deputy. A background 
+    thread checks Deputy for changes every 'interval' seconds and works the results out again only 
+    when something has changed. It reports each refresh with college.progress('refreshed', 'serve', 
+    updated) and any error with college.progress('error', 'serve', exception), then carries on 
+    with the results it has.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, college, interval, shift_obligations, location_name, include_list, start, end):
+        super().__init__(address, ReportHandler)
+        self.college      = college
+        self.interval     = interval
+        self.report_args  = (shift_obligations, location_name, include_list)
+        self.dates        = {'start_date': start, 'end_date': end}
+        self.lock         = threading.Lock()
+        self.results      = {}
+        self.updated      = None
+        self.stopping     = threading.Event()
+        self.refresher    = threading.Thread(target=self.refresh_loop, daemon=True)
+
+
+    def refresh(self):
+        """
+        Work out the results again if anything has changed in Deputy, and replace them all at once.
+        Returns False if nothing has changed.
+
+        May raise DeputyException.
+        """
+        if self.updated is not None and self.college.poll() == 0:
+            return False
+        self.college.invalidate()
+        del self.college.stats[:]
+        (shift_obligations, location_name, include_list) = self.report_args
+        report, students, journal = self.college.run_concurrently(
+            (self.college.student_report,         (shift_obligations, location_name, include_list), self.dates),
+            (self.college.bursary_student_list,   (include_list,), {}),
+            (self.college.deputy_journal_entries, (), self.dates))
+        with self.lock:
+            self.results = {'report': report, 'list': students, 'journal': journal}
+            self.updated = datetime.datetime.utcnow().isoformat().split('.')[0]
+        return True
+
+
+    def refresh_loop(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                if self.refresh():
+                    self.college.progress('refreshed', 'serve', self.updated)
+            except Exception as e:
+                # keep serving the last results rather than stopping the thread
+                self.college.progress('error', 'serve', e)
+                if isinstance(e, DeputyException) and e.code == 'request_budget':
+                    self.shutdown()
+                    return
+
+
+    def start(self):
+        # start checking for changes
+        self.refresher.start()
+
+
+    def stop(self):
+        self.stopping.set()
+        self.server_close()
+
+
+class ReportHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answer GET /report, /list or /journal from the ReportServer results, as JSON or as CSV with ?format=csv
+    """
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        name = url.path.strip('/')
+        output_format = urllib.parse.parse_qs(url.query).get('format', ['json'])[0]
+
+        with self.server.lock:
+            records = self.server.results.get(name)
+            updated = self.server.updated
+        if records is None:
+            self.send_error(404, 'Use /report, /list or /journal')
+            return
+
+        if output_format == 'json':
+            body = json.dumps({'updated': updated, 'records': [record._asdict() for record in records]}, 
+                indent=4, separators=(',', ': '), default=str)
+            content_type = 'application/json'
+        elif output_format == 'csv':
+            out = io.StringIO()
+            writer = csv.writer(out, quoting=csv.QUOTE_MINIMAL)
+            if len(records) > 0:
+                writer.writerow(records[0]._fields)
+            writer.writerows(records)
+            body = out.getvalue()
+            content_type = 'text/csv'
+        else:
+            self.send_error(400, 'Use format=json or format=csv')
+            return
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', '{0}; charset=utf-8'.format(content_type))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
 # ======================================================================================================================
 if __name__ == '__main__':
     # all printing occurs here to allow the classes above to be independantly instantiated.
@@ -1128,14 +2594,63 @@ if __name__ == '__main__':
         else:
             return missing
 
+    def print_resource(records, key='Id'):
+        # Print records as they arrive, in the same format as json.dumps() of an OrderedDict from resource().
+        count = 0
+        for record in records:
+            item = json.dumps(record, sort_keys=True, indent=4, separators=(',', ': ')).replace('\n', '\n    ')
+            print('{0}    {1}: {2}'.format('{\n' if count == 0 else ',\n', json.dumps(str(record[key])), item), end='')
+            count += 1
+        print('\n}' if count > 0 else '{}')
+        return count
+
     import_csv     = get_config(config, 'IMPORT', 'import_csv', missing='import.csv')
     deputy_csv     = get_config(config, 'IMPORT', 'deputy_csv', missing='deputy.csv')
+    journal_file   = get_config(config, 'IMPORT', 'journal', missing='deputy-journal.jsonl')
     email_test     = get_config(config, 'IMPORT', 'email_test')
     email_domain   = get_config(config, 'IMPORT', 'email_domain')
 
+    store_path     = get_config(config, 'CACHE', 'store')
+    store_reconcile = int(get_config(config, 'CACHE', 'reconcile', missing=86400))
+    cache_path     = get_config(config, 'CACHE', 'responses')
+    cache_size     = int(get_config(config, 'CACHE', 'response_size', missing=1000))
+    parse_path     = get_config(config, 'CACHE', 'parsed')
+
+    # seconds to cache responses for each resource, e.g. ttl_TrainingModule = 86400
+    cache_ttls = {}
+    if 'CACHE' in config.sections():
+        for item in config['CACHE']:
+            if item.startswith('ttl_'):
+                cache_ttls[item[4:]] = int(config['CACHE'][item])
+
     google_sheet_id             = get_config(config, 'SYNC', 'google_sheet_id')
     service_account_credentials = get_config(config, 'SYNC', 'service_account_credentials')
 
+    # shifts required for each year level, and the location they are worked at
+    if get_config(config, 'REPORT', 'shifts_year1') is None:
+        shift_obligations = None
+    else:
+        shift_obligations = {
+            'Year1':    get_config(config, 'REPORT', 'shifts_year1'),
+            'Year2':    get_config(config, 'REPORT', 'shifts_year2'),
+            'Year3':    get_config(config, 'REPORT', 'shifts_year3'),
+            'Year1NR':  get_config(config, 'REPORT', 'shifts_year1_nr')}  
+    location_name  = get_config(config, 'REPORT', 'location_name')
+
+    def open_google_sheet():
+        scopes = ['https://spreadsheets.google.com/feeds',
+                 'https://www.googleapis.com/auth/drive']
+
+        credentials = ServiceAccountCredentials.from_json_keyfile_name(service_account_credentials, scopes)
+        gc = gspread.authorize(credentials)
+
+        return gc.open_by_key(google_sheet_id)
+
+    def open_journal(args):
+        # only resume the interrupted run of the same command, against the same Deputy and import_csv
+        run = MutationJournal.fingerprint(args.command, args.endpoint, import_csv_fingerprint(args))
+        return MutationJournal(MutationJournal.command_path(args.journal, args.command), run)
+
 
     # students who don't have to do any bursaries
     exclude_list = []
@@ -1165,11 +2680,23 @@ if __name__ == '__main__':
         default=import_csv)
     parser.add_argument('--deputy_csv',     help='Deputy CSV output (override config file)',
         default=deputy_csv)
+    parser.add_argument('--journal',        help='Journal of changes, used to resume an interrupted run (override config file)',
+        default=journal_file)
     parser.add_argument('-t', '--timeout',  help='HTTP timeout',
         default=20, type=int)
+    parser.add_argument('-w', '--workers',  help='Number of resource pages fetched at once',
+        default=4, type=int)
+    parser.add_argument('--write-workers',  help='Number of changes made at once by add-year, delete-users and reinstate-users',
+        default=4, type=int)
+    parser.add_argument('-r', '--retries',  help='Number of times a failed read is retried',
+        default=3, type=int)
+    parser.add_argument('--max-wait',       help='Longest wait in seconds asked for by Deputy before a read is retried',
+        default=600, type=int)
+    parser.add_argument('--budget',         help='Maximum number of API requests for this run',
+        default=None, type=int)
     parser.add_argument('command',          help='command (e.g. status)',
         default='intro', nargs='?',
-        choices=['intro', 'config', 'list', 'report', 'sync', 'journal', 'user-csv', 'add-year', 
+        choices=['intro', 'config', 'list', 'report', 'sync', 'watch', 'serve', 'journal', 'user-csv', 'add-year', 
                  'delete-users', 'delete-123-users', 'reinstate-users', 'api', 'resource', 'rd', 'rc', 'test'])
     parser.add_argument('--api',            help='View API',
         default='me')
@@ -1183,16 +2710,53 @@ if __name__ == '__main__':
     parser.add_argument('--end',            help='End date for date based resources',
         default=get_config(config, 'REPORT', 'end_date', missing=None))
     parser.add_argument('--test',           help='Run script but don\'t perform any action (except creating deputy_csv)',  action='store_true')
+    parser.add_argument('--refresh',        help='Discard the local resource store and caches and fetch all records again', action='store_true')
+    parser.add_argument('--interval',       help='Seconds between checks for changes (watch and serve)',
+        default=60, type=int)
+    parser.add_argument('--port',           help='Local port for serve',
+        default=8080, type=int)
     args = parser.parse_args()
 
     if args.test:
         print('Test mode active.')
 
     # All exceptions are fatal. API errors are displayed in the except statement.
+    if store_path is None:
+        # watch and serve check the store for changes, so they need one even if it is not kept between runs
+        store = ResourceStore(':memory:', reconcile=store_reconcile) if args.command in ('watch', 'serve') else None
+    else:
+        store = ResourceStore(os.path.expanduser(store_path), reconcile=store_reconcile)
+        if args.refresh:
+            store.clear()
+
+    if cache_path is None:
+        cache = None
+    else:
+        cache = ResponseCache(os.path.expanduser(cache_path), ttls=cache_ttls, max_entries=cache_size)
+        if args.refresh:
+            cache.clear()
+
+    if parse_path is None:
+        parse_cache = None
+    else:
+        parse_cache = ParseCache(os.path.expanduser(parse_path))
+        if args.refresh:
+            parse_cache.clear()
+
+    deputy_options = {
+        'workers': args.workers,
+        'write_workers': args.write_workers,
+        'store':   store,
+        'cache':   cache,
+        'retries': args.retries,
+        'budget':  args.budget,
+        'max_wait': args.max_wait,
+        }
+
+    #deputy = Deputy(args.endpoint, args.token, args.timeout)
+    college = College(args.endpoint, args.token, args.timeout, parse_cache=parse_cache, **deputy_options)
     try:
         p = Printx(csv_flag=args.csv)
-        #deputy = Deputy(args.endpoint, args.token, args.timeout)
-        college = College(args.endpoint, args.token, args.timeout)
         api_resp = college.api('me')        
 
 
@@ -1219,49 +2783,45 @@ if __name__ == '__main__':
             # UTF8 sig -- https://stackoverflow.com/questions/17912307/u-ufeff-in-python-string
             out_csv = open(args.deputy_csv, 'w', newline='')
 
-            # get a list of student email addresses so we can remove already added users
-            email_list = []
-            for s in college.bursary_student_list(include_list):
-                email_list.append(s.Email)
+            # get the students by email address so we can remove already added users
+            employees_by_email = {s.Email: s._asdict() for s in college.bursary_student_list(include_list)}
+
+            try:
+                (messages, students) = college.read_students(open_import_csv_reader(args), args.mobile, 
+                    fingerprint=import_csv_fingerprint(args))
+            except KeyError as e:
+                sys.exit(f'Fatal Error. Missing import_csv header row: {e}. Check for extra space characters.')
+            if len(messages) > 0:
+               p.text('\n'.join(messages))
+            plan = college.plan_changes(students, employees_by_email=employees_by_email)
 
-            reader = open_import_csv_reader(args)
             writer = csv.DictWriter(out_csv, fieldnames=college.DEPUTY_COLS)
             writer.writeheader()
 
             count = 0
             ignored = 0
             year_count = {'Year1': 0, 'Year2': 0, 'Year3':0, 'Year1NR': 0}
-            for in_row in reader:
-                try:
-                    (messages, parsed_row) = college.parse_student_record(in_row, args.mobile)
-                except KeyError as e:
-                    sys.exit(f'Fatal Error. Missing import_csv header row: {e}. Check for extra space characters.')
-                # parsed_row contains: first_name, last_name, student_id (i.e. NetworkLogin), email, year, mobile
-                if len(messages) > 0:
-                   p.text('\n'.join(messages))
-                if parsed_row is not None:
-                    if parsed_row['email'] in email_list:
-                        #p.text('Ignoring user already in deputy: {0} {1} ({2})', parsed_row['first_name'], parsed_row['last_name'], parsed_row['email'])
-                        #ignored += 1
-                        continue
-                    if parsed_row['year'] is None:
-                        #p.text('Ignoring user with missing UOMYear: {0} {1} ({2})', parsed_row['first_name'], parsed_row['last_name'], parsed_row['email'])
-                        #ignored += 1
-                        continue
-                    if len(parsed_row['student_id']) == 0:  # i.e. NetworkLogin
-                        p.text('Ignoring user without a NetworkLogin: {0} {1} ({2})', parsed_row['first_name'], parsed_row['last_name'], parsed_row['email'])
-                        ignored += 1
-                        continue
-                    new_row = {
-                        'First Name':       parsed_row['first_name'],
-                        'Last Name':        parsed_row['last_name'],
-                        'Time Card Number': parsed_row['student_id'],
-                        'Email':            parsed_row['email'],
-                        'Mobile Number':    '', #parsed_row['mobile'], ## SMS messages cost too much so don't add a phone number.
-                        }
-                    writer.writerow(new_row)
-                    year_count[parsed_row['year']] += 1
-                    count += 1
+            # parsed_row contains: first_name, last_name, student_id (i.e. NetworkLogin), email, year, mobile
+            for parsed_row in plan.creates:
+                if parsed_row['year'] is None:
+                    #p.text('Ignoring user with missing UOMYear: {0} {1} ({2})', parsed_row['first_name'], parsed_row['last_name'], parsed_row['email'])
+                    #ignored += 1
+                    continue
+                if len(parsed_row['student_id']) == 0:  # i.e. NetworkLogin
+                    p.text('Ignoring user without a NetworkLogin: {0} {1} ({2})', parsed_row['first_name'], parsed_row['last_name'], parsed_row['email'])
+                    ignored += 1
+                    continue
+                new_row = {
+                    'First Name':       parsed_row['first_name'],
+                    'Last Name':        parsed_row['last_name'],
+                    'Time Card Number': parsed_row['student_id'],
+                    'Email':            parsed_row['email'],
+                    'Mobile Number':    '', #parsed_row['mobile'], ## SMS messages cost too much so don't add a phone number.
+                    }
+                writer.writerow(new_row)
+                year_count[parsed_row['year']] += 1
+                count += 1
+            out_csv.close()
 
             p.text('Students in Year1: {Year1}; Year2: {Year2}; Year3: {Year3}; Year1NR: {Year1NR}'.format(**year_count))
             p.text('Ignored {0} students.', ignored)
@@ -1274,7 +2834,8 @@ if __name__ == '__main__':
             years = college.years()
             p.text('Fetching training records (for year)...')
             student_years = college.student_years()
-            messages = college.add_years_to_student_records(years, student_years, open_import_csv_reader(args), test=args.test)
+            messages = college.add_years_to_student_records(years, student_years, open_import_csv_reader(args), test=args.test, 
+                fingerprint=import_csv_fingerprint(args))
             p.text('\n'.join(messages))
 
 
@@ -1284,7 +2845,9 @@ if __name__ == '__main__':
             students = college.employee_by_email()
             p.text('Fetching training records (for year)...')
             student_years = college.student_years()
-            messages = college.delete_users(students, student_years, open_import_csv_reader(args), use_csv=True, test=args.test)
+            journal = None if args.test else open_journal(args)
+            messages = college.delete_users(students, student_years, open_import_csv_reader(args), use_csv=True, test=args.test, 
+                journal=journal, fingerprint=import_csv_fingerprint(args))
             # ToDo: fix KeyError: "'EmergencyAddress'" in the line below @line 261
             # ToDo: fix KeyError: "'PostalAddress'"
             # Todo: fix KeyError: "'Id'"
@@ -1297,7 +2860,9 @@ if __name__ == '__main__':
             students = college.employee_by_email()
             p.text('Fetching training records (for year)...')
             student_years = college.student_years()
-            messages = college.delete_users(students, student_years, open_import_csv_reader(args), use_csv=False, test=args.test)
+            journal = None if args.test else open_journal(args)
+            messages = college.delete_users(students, student_years, open_import_csv_reader(args), use_csv=False, test=args.test, 
+                journal=journal, fingerprint=import_csv_fingerprint(args))
             p.text('\n'.join(messages))
 
 
@@ -1307,7 +2872,8 @@ if __name__ == '__main__':
             students = college.discarded_employee_by_email()
             p.text('Fetching training records (for year)...')
             student_years = college.student_years()
-            messages = college.reinstate_users(students, student_years, open_import_csv_reader(args))
+            messages = college.reinstate_users(students, student_years, open_import_csv_reader(args), 
+                journal=open_journal(args), fingerprint=import_csv_fingerprint(args))
             # ToDo: fix KeyError: "'EmergencyAddress'" in the line below @line 261
             # ToDo: fix KeyError: "'PostalAddress'"
             p.text('\n'.join(messages))
@@ -1337,16 +2903,6 @@ if __name__ == '__main__':
             p.headers('Name', 'Year', 'Obligation', 'Rostered', 'Open', 'Completed', 
                 '% Rostered', '% Completed', 'Issues') # removed for now 'Timesheets'
 
-            # Fetch student and config data
-            if get_config(config, 'REPORT', 'shifts_year1') is None:
-                shift_obligations = None
-            else:
-                shift_obligations = {
-                    'Year1':    get_config(config, 'REPORT', 'shifts_year1'),
-                    'Year2':    get_config(config, 'REPORT', 'shifts_year2'),
-                    'Year3':    get_config(config, 'REPORT', 'shifts_year3'),
-                    'Year1NR':  get_config(config, 'REPORT', 'shifts_year1_nr')}  
-            location_name  = get_config(config, 'REPORT', 'location_name')
             for student in college.student_report(shift_obligations, location_name, include_list, start_date=args.start, end_date=args.end):
                 p.data('{0} ({1}): {2}, {3}, {4} {5} {6} {7} {8}', *student)
             p.stats(college)
@@ -1355,31 +2911,64 @@ if __name__ == '__main__':
         elif args.command == 'sync':
             p.text('Student tally spreadsheet sync ({} to {}).\n'.format(args.start, args.end))
 
-            # Fetch student and config data
-            if get_config(config, 'REPORT', 'shifts_year1') is None:
-                shift_obligations = None
-            else:
-                shift_obligations = {
-                    'Year1':    get_config(config, 'REPORT', 'shifts_year1'),
-                    'Year2':    get_config(config, 'REPORT', 'shifts_year2'),
-                    'Year3':    get_config(config, 'REPORT', 'shifts_year3'),
-                    'Year1NR':  get_config(config, 'REPORT', 'shifts_year1_nr')}  
-            location_name  = get_config(config, 'REPORT', 'location_name')
+            result = sync_with_sheet(args.endpoint, args.token, args.timeout, open_google_sheet(), 
+                shift_obligations, location_name, include_list, args.start, args.end, college=college)
 
-            # Google Sheet
-            scopes = ['https://spreadsheets.google.com/feeds',
-                     'https://www.googleapis.com/auth/drive']
+            for key in result.keys():
+                print(key, result[key])
 
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(service_account_credentials, scopes)
-            gc = gspread.authorize(credentials)
 
-            sheet = gc.open_by_key(google_sheet_id)
+        elif args.command == 'watch':
+            # Sync the sheet, then check Deputy every interval for any changes since the last check, 
+            # syncing again only when there are some. The connections, store and cache stay open.
+            p.text('Student tally spreadsheet sync ({} to {}) every {} seconds. Ctrl-C to stop.\n'.format(
+                args.start, args.end, args.interval))
+            sheet = open_google_sheet()
 
-            result = sync_with_sheet(args.endpoint, args.token, args.timeout, sheet, 
+            synced = False
+            while True:
+                try:
+                    changes = None if not synced else college.poll()
+                    if changes != 0:
+                        # the report is worked out again from the store
+                        college.invalidate()
+                        del college.stats[:]
+                        result = sync_with_sheet(args.endpoint, args.token, args.timeout, sheet, 
+                            shift_obligations, location_name, include_list, args.start, args.end, college=college)
+                        synced = True
+                        print(result['last_updated'], ', '.join('{0} {1}'.format(key, result[key]) for key in result 
+                            if key != 'last_updated'))
+                except DeputyException as e:
+                    if e.code in ('user_exit', 'request_budget'):
+                        raise
+                    print(str(e))
+                except gspread.exceptions.GSpreadException as e:
+                    print('[Google Sheet] {0}'.format(e))
+                college.sleep(args.interval)
+
+
+        elif args.command == 'serve':
+            # Keep the report, list and journal results in memory and serve them on a local port.
+            def serve_progress(ptype, function, position):
+                if ptype == 'refreshed':
+                    print('Refreshed', position)
+                elif ptype == 'error':
+                    print(str(position) if isinstance(position, DeputyException) else 
+                        'Refresh failed: {0}: {1}'.format(type(position).__name__, position))
+            college.progress = serve_progress
+            server = ReportServer(('localhost', args.port), college, args.interval, 
                 shift_obligations, location_name, include_list, args.start, args.end)
-
-            for key in result.keys():
-                print(key, result[key])
+            p.text('Fetching report, list and journal ({} to {})...'.format(args.start, args.end))
+            server.refresh()
+            p.text('Serving /report, /list and /journal on http://localhost:{0}/ (add ?format=csv for CSV). Ctrl-C to stop.', 
+                args.port)
+            server.start()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                raise DeputyException('user_exit', 'Ctrl-C - User requested exit.')
+            finally:
+                server.stop()
 
 
         elif args.command == 'api':
@@ -1401,25 +2990,23 @@ if __name__ == '__main__':
         elif args.command == 'rd':
             # e.g. python3 deputy.py resource --resource
             p.text('Fetching resource by Date...{}, ({} to {})', args.resource, args.start, args.end)
-            api_resp = college.resource(args.resource, 
+            count = print_resource(college.iter_resource(args.resource, 
                 select=[
                     ('Date', 'ge',  args.start),
                     ('Date', 'le',  args.end)
-                ])
-            print(json.dumps(api_resp, sort_keys=True, indent=4, separators=(',', ': ')))
-            print('{0} Resource records returned.'.format(len(api_resp)))
+                ]))
+            print('{0} Resource records returned.'.format(count))
 
 
         elif args.command == 'rc':
             # e.g. python3 deputy.py resource --resource
             p.text('Fetching resource by Created date...{}, ({} to {})', args.resource, args.start, args.end)
-            api_resp = college.resource(args.resource, 
+            count = print_resource(college.iter_resource(args.resource, 
                 select=[
                     ('Created', 'ge',  args.start),
                     ('Created', 'le',  args.end)
-                ])
-            print(json.dumps(api_resp, sort_keys=True, indent=4, separators=(',', ': ')))
-            print('{0} Resource records returned.'.format(len(api_resp)))
+                ]))
+            print('{0} Resource records returned.'.format(count))
 
 
         elif args.command == 'test':
@@ -1570,4 +3157,7 @@ if __name__ == '__main__':
         print(str(e))
         sys.exit(1)
 
+    finally:
+        college.close()
+
     sys.exit(0)
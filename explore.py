@@ -5,8 +5,9 @@
 # Explore information about employees.
 
 import argparse
+import asyncio
 import configparser
-from deputy import Deputy
+from deputy import AsyncDeputy
 from deputy import DeputyException
 import json
 import os
@@ -18,8 +19,72 @@ def get_config(config, section, item, missing=None):
             return config[section][item]
     return missing
 
-def get_resource(resource_name, count=True, select=None):
-    res = deputy.resource(resource_name)
+# Resources fetched by explore() and the fields that may contain an employee_id.
+# List created by eyeballing the Deputy API Docs — they are not always create on what a field contains
+# https://api-doc.deputy.com/Resources/Employee
+RESOURCES = [
+    ('Address',                  ['Creator']),
+    ('Category',                 ['Creator']),
+    ('Company',                  ['Creator']),
+    # CompanyPeriod has Creator always set to -1?
+    ('CompanyPeriod',            ['Creator']),
+    ('Contact',                  ['Creator']),
+    ('Country',                  ['Creator']),
+    ('CustomAppData',            ['Creator', 'Employee']),
+    ('CustomField',              ['Creator']),
+    ('CustomFieldData',          ['Creator']),
+    ('Employee',                 ['Id', 'Creator']),
+    ('EmployeeAgreement',        ['Creator', 'EmployeeId']),
+    ('EmployeeAgreementHistory', ['Creator']),
+    ('EmployeeAppraisal',        ['Creator', 'Employee']),
+    # EmployeeAvailability
+    # EmployeeHistory
+    # EmployeePaycycle
+    # EmployeePaycycleReturn
+    # EmployeeRole
+    # EmployeeSalaryOpunitCosting
+    # EmployeeWorkplace
+    # EmploymentCondition
+    # EmploymentContract
+    # EmploymentContractLeaveRules
+    ('Event',                    ['Creator']),
+    ('Geo',                      ['Creator']),
+    ('Journal',                  ['Creator', 'EmployeeId']),
+    ('Kiosk',                    ['Creator']),
+    # KpiBudget
+    # KpiEntry
+    # KpiMetric
+    # KpiShiftReport
+    ('Leave',                    ['Creator', 'Employee']),
+    # LeavePayLine
+    # LeaveRules
+    ('Memo',                     ['Creator']),
+    ('Noticeboard',              ['Creator']),
+    # OperationalUnit
+    # OpunitKpiMetricConfig
+    # PayPeriod
+    # PayRules
+    ('Roster',                   ['Creator', 'ConfirmBy', 'Employee']),
+    # [Exception: http_error] API resource/RosterOpen failed with 400 Bad Request.
+    # ('RosterOpen',             ['Creator', 'Employee']),
+    ('SalesData',                ['Creator', 'Employee']),
+    ('Schedule',                 ['Creator']),
+    ('SmsLog',                   ['Creator']),
+    # State
+    # SystemUsageBalance
+    # SystemUsageTracking
+    # Task
+    # TaskGroup
+    # TaskGroupSetup
+    # TaskOpunitConfig
+    # TaskSetup
+    ('Timesheet',                ['Creator', 'Employee', 'Supervisor']),
+    # TimesheetPayReturn
+    # TrainingModule
+    ('TrainingRecord',           ['Creator', 'Employee']),
+    ]
+
+def show_resource(resource_name, res, count=True, select=None):
     if count:
         print('Imported {0} records from resource {1}.'.format(len(res), resource_name))
     if select is not None:
@@ -47,10 +112,36 @@ def extract(resource_name, resources, employees, find_id=None, count=True, attri
                     else:
                         print('  [{0}:{1}] {2}: *Employee not found* ({3})'.format(resource_name, resource_id, attribute, a_id))
 
-def get_resource_and_extract(resource_name, employees, find_id=None, attributes=['Creator']):
-    data = get_resource(resource_name)
-    extract(resource_name, data, employees, find_id=find_id, attributes=attributes)
-    return data
+async def explore(deputy, find_id=None):
+    # fetch all the resources at once, then list them in order
+    employees = await deputy.resource('Employee')
+    show_resource('Employee', employees)
+    resource_names = [resource_name for resource_name, attributes in RESOURCES if resource_name != 'Employee']
+    resources = dict(zip(resource_names, await asyncio.gather(*[deputy.resource(r) for r in resource_names])))
+    resources['Employee'] = employees
+    for resource_name, attributes in RESOURCES:
+        if resource_name != 'Employee':
+            show_resource(resource_name, resources[resource_name])
+        extract(resource_name, resources[resource_name], employees, find_id=find_id, attributes=attributes)
+    return resources
+
+
+async def main(args):
+    deputy = AsyncDeputy(args.endpoint, args.token, args.timeout)
+    try:
+        api_resp = await deputy.api('me')
+        print('DeputyVersion: {0} running as {1}.\n'.format(api_resp['DeputyVersion'], api_resp['Name']))
+
+        if args.list:
+            # fetch a list of all employees and list in alphabetical order
+            employees = await deputy.resource('Employee', sort='LastName')
+            for id in employees:
+                employee = employees[id]
+                print('[{0}] {1}'.format(employee['Id'], employee['DisplayName']))
+        else:
+            await explore(deputy, find_id=args.id)
+    finally:
+        deputy.close()
 
 
 def pprint(data):
@@ -80,82 +171,8 @@ if __name__ == '__main__':
 
     # All exceptions are fatal. API errors are displayed in the except statement.
     try:
-        deputy = Deputy(args.endpoint, args.token, args.timeout)
-        api_resp = deputy.api('me')
-        print('DeputyVersion: {0} running as {1}.\n'.format(api_resp['DeputyVersion'], api_resp['Name']))
-
-        if args.list:
-            # fetch a list of all employees and list in alphabetical order
-            employees = deputy.resource('Employee', sort='LastName')
-            for id in employees:
-                employee = employees[id]
-                print('[{0}] {1}'.format(employee['Id'], employee['DisplayName']))
-        else:
-            # List created by eyeballing the Deputy API Docs — they are not always create on what a field contains
-            # https://api-doc.deputy.com/Resources/Employee
-            Employee = get_resource('Employee')
-            Address =           get_resource_and_extract('Address', Employee, find_id=args.id)
-            Category =          get_resource_and_extract('Category', Employee, find_id=args.id)
-            Company =           get_resource_and_extract('Company', Employee, find_id=args.id)
-            # CompanyPeriod has Creator always set to -1?
-            CompanyPeriod =     get_resource_and_extract('CompanyPeriod', Employee, find_id=args.id)  
-            Contact =           get_resource_and_extract('Contact', Employee, find_id=args.id)
-            Country =           get_resource_and_extract('Country', Employee, find_id=args.id)
-            CustomAppData =     get_resource_and_extract('CustomAppData', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-            CustomField =       get_resource_and_extract('CustomField', Employee, find_id=args.id)
-            CustomFieldData =   get_resource_and_extract('CustomFieldData', Employee, find_id=args.id)
-            extract('Employee', Employee, Employee, find_id=args.id, attributes=['Id', 'Creator'])
-            EmployeeAgreement = get_resource_and_extract('EmployeeAgreement', Employee, find_id=args.id, attributes=['Creator', 'EmployeeId'])
-            EmployeeAgreementHistory = get_resource_and_extract('EmployeeAgreementHistory', Employee, find_id=args.id)
-            EmployeeAppraisal = get_resource_and_extract('EmployeeAppraisal', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-            # EmployeeAvailability
-            # EmployeeHistory
-            # EmployeePaycycle
-            # EmployeePaycycleReturn
-            # EmployeeRole
-            # EmployeeSalaryOpunitCosting
-            # EmployeeWorkplace
-            # EmploymentCondition
-            # EmploymentContract
-            # EmploymentContractLeaveRules
-            Event =             get_resource_and_extract('Event', Employee, find_id=args.id)
-            Geo =               get_resource_and_extract('Geo', Employee, find_id=args.id)
-            Journal =           get_resource_and_extract('Journal', Employee, find_id=args.id, attributes=['Creator', 'EmployeeId'])
-            Kiosk =             get_resource_and_extract('Kiosk', Employee, find_id=args.id)
-            # KpiBudget
-            # KpiEntry
-            # KpiMetric
-            # KpiShiftReport
-            Leave =             get_resource_and_extract('Leave', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-            # LeavePayLine
-            # LeaveRules
-            Memo =              get_resource_and_extract('Memo', Employee, find_id=args.id)
-            Noticeboard =       get_resource_and_extract('Noticeboard', Employee, find_id=args.id)
-            # OperationalUnit
-            # OpunitKpiMetricConfig
-            # PayPeriod
-            # PayRules
-            Roster =            get_resource_and_extract('Roster', Employee, find_id=args.id, attributes=['Creator', 'ConfirmBy', 'Employee'])
-            # [Exception: http_error] API resource/RosterOpen failed with 400 Bad Request.
-            # RosterOpen =        get_resource_and_extract('RosterOpen', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-            SalesData =         get_resource_and_extract('SalesData', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-            Schedule =          get_resource_and_extract('Schedule', Employee, find_id=args.id)
-            SmsLog =            get_resource_and_extract('SmsLog', Employee, find_id=args.id)
-            # State
-            # SystemUsageBalance
-            # SystemUsageTracking
-            # Task
-            # TaskGroup
-            # TaskGroupSetup
-            # TaskOpunitConfig
-            # TaskSetup
-            Timesheet =         get_resource_and_extract('Timesheet', Employee, find_id=args.id, attributes=['Creator', 'Employee', 'Supervisor'])
-            # TimesheetPayReturn
-            # TrainingModule
-            TrainingRecord =    get_resource_and_extract('TrainingRecord', Employee, find_id=args.id, attributes=['Creator', 'Employee'])
-
+        asyncio.run(main(args))
 
     except DeputyException as e:
         print(str(e))
         sys.exit(1)
-